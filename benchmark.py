@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import random
+import gc
+import argparse
+import tempfile
+import itertools
+import linecache
+import tracemalloc
+
+
+from game import Game
+from scripts.levels import LevelCache, compiled_path
+
+
+SCENARIOS = {
+    'shipped': {'width': 30, 'height': 20, 'boxes': 10, 'enemies': 3, 'pairs': 2},
+    'boxes': {'width': 60, 'height': 40, 'boxes': 300, 'enemies': 0, 'pairs': 0},
+    'enemies': {'width': 60, 'height': 40, 'boxes': 0, 'enemies': 200, 'pairs': 0},
+    'crowd': {'width': 100, 'height': 60, 'boxes': 400, 'enemies': 200, 'pairs': 30},
+    'large_grid': {'width': 300, 'height': 300, 'boxes': 50, 'enemies': 20, 'pairs': 10},
+}
+QUICK_SCENARIOS = ('shipped', 'boxes', 'enemies')
+COLORS = ('red', 'green', 'blue')
+CODE_FILTER = [tracemalloc.Filter(True, os.path.join(os.path.dirname(os.path.abspath(__file__)), '*')),
+               tracemalloc.Filter(False, os.path.abspath(__file__))]
+# Lines whose retained blocks are replaced values rather than growth: floats and ints written back into entity
+# state, spatial hash cell keys and the rest history of a settling box. A bucket is also created the first time
+# anything enters a spatial hash cell; buckets are kept, so that stops once the reachable cells are visited.
+ALLOC_SOURCES = ('self.ticks += 1', 'self.pos[', 'self.velocity[', 'player.pos[', 'box.pos[', 'enemy.pos[',
+                 'self.counts[', 'return int(pos[0] // self.cell_size)', 'history.append(', 'self.cycle = ',
+                 'self.cells[cell] = [entity]')
+
+
+def generate_map(width, height, boxes=0, enemies=0, pairs=0, seed=0):
+    rng = random.Random(seed)
+    tilemap = {}
+
+    def put(x, y, tile_type):
+        tilemap[str(x) + ';' + str(y)] = {'type': tile_type, 'pos': [x, y]}
+
+    for x in range(width):
+        put(x, 0, 'stone')
+        put(x, height - 1, 'stone')
+    for y in range(1, height - 1):
+        put(0, y, 'stone')
+        put(width - 1, y, 'stone')
+    for y in range(4, height - 1, 4):
+        for x in range(1, width - 1):
+            put(x, y, 'stone')
+
+    slots = [(x, y - 1) for y in range(4, height, 4) for x in range(1, width - 1)]
+    rng.shuffle(slots)
+    spawns = ['player', 'exit'] + ['box'] * boxes + ['enemy'] * enemies
+    for i in range(pairs):
+        spawns += ['button_' + COLORS[i % len(COLORS)], 'door_' + COLORS[i % len(COLORS)]]
+    for tile_type, (x, y) in zip(spawns, slots):
+        put(x, y - 1 if tile_type == 'exit' else y, tile_type)
+
+    return {'tilemap': tilemap, 'tile_size': 16, 'offgrid': []}
+
+
+def rate(func, seconds):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(100):
+            func()
+        calls += 100
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def allocations(game, ticks=600, inputs=0):
+    for _ in itertools.repeat(None, ticks):
+        game.step(inputs)
+    tracemalloc.start()
+    for _ in itertools.repeat(None, ticks):
+        game.step(inputs)
+    # A full collection empties the interpreter's free lists, so a recycled block is charged to the line reusing it.
+    gc.collect()
+    before = tracemalloc.take_snapshot().filter_traces(CODE_FILTER)
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in itertools.repeat(None, ticks):
+        game.step(inputs)
+    peak = tracemalloc.get_traced_memory()[1]
+    gc.collect()
+    after = tracemalloc.take_snapshot().filter_traces(CODE_FILTER)
+    tracemalloc.stop()
+    sources = {}
+    for stat in after.compare_to(before, 'lineno'):
+        frame = stat.traceback[0]
+        if stat.size_diff > 0 and not linecache.getline(frame.filename, frame.lineno).strip().startswith(ALLOC_SOURCES):
+            sources[str(frame)] = stat.size_diff
+    return sum(sources.values()) / ticks, peak - start, sources
+
+
+def join_prefetch(levels):
+    for thread in list(levels.pending.values()):
+        thread.join()
+
+
+def load_ms(game, map_id):
+    join_prefetch(game.levels)
+    game.levels = LevelCache(game.levels.maps_dir)
+    start = time.perf_counter()
+    game.load_level(map_id)
+    elapsed = (time.perf_counter() - start) * 1000
+    join_prefetch(game.levels)
+    return elapsed
+
+
+def run_scenario(game, map_id, seconds, alloc=False):
+    results = {}
+    tilemap = game.tilemap
+    rng = random.Random(map_id)
+    width = tilemap.grid_width * tilemap.tile_size
+    height = tilemap.grid_height * tilemap.tile_size
+    positions = [(rng.uniform(0, width), rng.uniform(0, height)) for _ in range(1000)]
+    cursor = [0]
+
+    def next_pos():
+        cursor[0] = (cursor[0] + 1) % len(positions)
+        return positions[cursor[0]]
+
+    results['tiles_around_per_s'] = rate(lambda: tilemap.tiles_around(next_pos()), seconds)
+    results['physics_rects_around_per_s'] = rate(lambda: tilemap.physics_rects_around(next_pos()), seconds)
+
+    results['load_level_ms'] = load_ms(game, map_id)
+    compiled = compiled_path(game.levels.path(map_id))
+    if os.path.exists(compiled):
+        os.remove(compiled)
+    results['load_compile_ms'] = load_ms(game, map_id)
+
+    start = time.perf_counter()
+    tilemap.render(game.display)
+    results['render_bake_ms'] = (time.perf_counter() - start) * 1000
+    results['render_per_s'] = rate(lambda: tilemap.render(game.display), seconds)
+
+    results['ticks_per_s'] = rate(game.step, seconds)
+    if alloc:
+        results['alloc_bytes_per_tick'], results['alloc_peak_bytes'], sources = allocations(game)
+        for source, size in sources.items():
+            print(f'  retained {size} B at {source}')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if not old or not value:
+                continue
+            change = value / old - 1 if metric.endswith('_per_s') else old / value - 1
+            flag = ''
+            if change < -tolerance:
+                flag = '  REGRESSION'
+                regressions.append((name, metric))
+            print(f'{name:<12} {metric:<28} {old:12.2f} -> {value:12.2f} {change:+7.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--seconds', type=float, default=0.5)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--alloc', action='store_true')
+    parser.add_argument('scenarios', nargs='*')
+    args = parser.parse_args()
+
+    names = args.scenarios or (QUICK_SCENARIOS if args.quick else list(SCENARIOS))
+    maps_dir = tempfile.mkdtemp(prefix='diploma_bench_')
+    for map_id, name in enumerate(names):
+        f = open(os.path.join(maps_dir, str(map_id) + '.json'), 'w')
+        json.dump(generate_map(seed=map_id, **SCENARIOS[name]), f)
+        f.close()
+
+    results = {}
+    game = None
+    for map_id, name in enumerate(names):
+        if game is None:
+            start = time.perf_counter()
+            game = Game(headless=True, level=map_id, maps_dir=maps_dir)
+            game.render()
+            results['startup'] = {'first_frame_ms': (time.perf_counter() - start) * 1000}
+            print('startup', f"first_frame_ms={results['startup']['first_frame_ms']:.2f}")
+        game.level = map_id
+        game.load_level(map_id)
+        results[name] = run_scenario(game, map_id, args.seconds, args.alloc)
+        print(name, ' '.join(f'{metric}={value:.2f}' for metric, value in results[name].items()))
+
+    f = open(args.output, 'w')
+    json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+    f.close()
+
+    if args.baseline:
+        f = open(args.baseline, 'r')
+        baseline = json.load(f)['results']
+        f.close()
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
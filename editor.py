@@ -1,41 +1,98 @@
+import os
 import pygame
 import sys
+import subprocess
 
 
-from scripts.utils import load_image
+from scripts.assets import AssetManager
+from scripts.camera import Camera
+from scripts.history import EditHistory
+from scripts.present import Presenter
+from scripts.profiler import FrameProfiler
+from scripts.signals import CHANNEL_COLORS
 from scripts.tilemap import Tilemap
 
 
 RENDER_SCALE = 2.0
 MAP_LOAD = 19
 MAP_SAVE = 19
+SOLVER_LOG = 'data/maps/solutions/' + str(MAP_SAVE) + '.log'
+PROFILE_PHASES = ('tilemap', 'edit', 'events', 'present')
+EDITOR_TILES = ('exit', 'stone', 'spikes', 'player', 'enemy', 'box', 'button_red', 'door_red', 'button_green',
+                'door_green', 'button_blue', 'door_blue', 'rip', 'torch')
+BRUSHES = ('pencil', 'rect', 'fill')
+FILL_LIMIT = 4096
+
+
+def tile_loc(tile_pos):
+    return str(tile_pos[0]) + ';' + str(tile_pos[1])
+
+
+def line_tiles(start, end):
+    x, y = start
+    dx = abs(end[0] - x)
+    dy = -abs(end[1] - y)
+    sx = 1 if end[0] > x else -1
+    sy = 1 if end[1] > y else -1
+    error = dx + dy
+    tiles = [(x, y)]
+    while (x, y) != tuple(end):
+        e2 = error * 2
+        if e2 >= dy:
+            error += dy
+            x += sx
+        if e2 <= dx:
+            error += dx
+            y += sy
+        tiles.append((x, y))
+    return tiles
+
+
+def rect_tiles(start, end):
+    return [(x, y) for y in range(min(start[1], end[1]), max(start[1], end[1]) + 1)
+            for x in range(min(start[0], end[0]), max(start[0], end[0]) + 1)]
+
+
+def flood_tiles(tilemap, start, limit=FILL_LIMIT):
+    tile = tilemap.tilemap.get(tile_loc(start))
+    target = tile['type'] if tile else None
+    x0, y0 = tilemap.grid_origin
+    x1 = x0 + tilemap.grid_width
+    y1 = y0 + tilemap.grid_height
+    if target is None and not (x0 <= start[0] < x1 and y0 <= start[1] < y1):
+        return []
+    seen = {tuple(start)}
+    stack = [tuple(start)]
+    tiles = []
+    while stack and len(tiles) < limit:
+        x, y = stack.pop()
+        tiles.append((x, y))
+        for pos in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if pos in seen or (target is None and not (x0 <= pos[0] < x1 and y0 <= pos[1] < y1)):
+                continue
+            tile = tilemap.tilemap.get(tile_loc(pos))
+            if (tile['type'] if tile else None) == target:
+                seen.add(pos)
+                stack.append(pos)
+    return tiles
 
 
 class Editor:
     def __init__(self):
-        pygame.init()
+        pygame.display.init()
+        pygame.font.init()
 
         pygame.display.set_caption('Editor')
         self.screen = pygame.display.set_mode((960, 640))
         self.display = pygame.Surface((480, 320))
+        self.presenter = Presenter(self.screen, self.display)
+        self.camera = Camera(self.display.get_size())
+        self.scrolling = [False, False, False, False]
         self.clock = pygame.time.Clock()
-        self.assets = {
-            'exit': load_image('exit.png'),
-            'stone': load_image('stone.png'),
-            'spikes': load_image('spikes.png'),
-            'player': load_image('player.png'),
-            'enemy': load_image('enemy.png'),
-            'box': load_image('box.png'),
-            'button_red': load_image('button_red.png'),
-            'door_red': load_image('door_red.png'),
-            'button_green': load_image('button_green.png'),
-            'door_green': load_image('door_green.png'),
-            'button_blue': load_image('button_blue.png'),
-            'door_blue': load_image('door_blue.png'),
-            'rip': load_image('rip.png'),
-            'torch': load_image('torch.png'),
-        }
-        self.tile_list = list(self.assets)
+        self.assets = AssetManager()
+        self.tile_list = list(EDITOR_TILES)
+        for color in CHANNEL_COLORS:
+            self.tile_list += ['button_' + color, 'door_' + color]
         self.tile_group = 0
         self.tilemap = Tilemap(self, tile_size=16)
 
@@ -47,48 +104,101 @@ class Editor:
         self.clicking = False
         self.right_clicking = False
         self.ongrid = True
+        self.brush = 0
+        self.anchor = None
+        self.last_tile = None
+        self.history = EditHistory(self.tilemap)
+        self.save_thread = None
+        self.solver = None
+        self.profiler = FrameProfiler(PROFILE_PHASES)
+
+    def paint(self, positions, erase=False):
+        if erase:
+            changes = {tile_loc(pos): None for pos in positions}
+        else:
+            tile_type = self.tile_list[self.tile_group]
+            changes = {tile_loc(pos): {'type': tile_type, 'pos': pos} for pos in positions}
+        self.history.set_tiles(changes)
+
+    def release(self, tile_pos, erase=False):
+        if self.anchor is not None and BRUSHES[self.brush] == 'rect':
+            self.paint(rect_tiles(self.anchor, tile_pos), erase)
+        self.anchor = None
+        if not self.clicking and not self.right_clicking:
+            self.history.end()
+
+    def saved(self, path):
+        if self.solver and self.solver.poll() is None:
+            self.solver.terminate()
+            self.solver.wait()
+        os.makedirs(os.path.dirname(SOLVER_LOG), exist_ok=True)
+        log = open(SOLVER_LOG, 'w')
+        self.solver = subprocess.Popen([sys.executable, 'solver.py', str(MAP_SAVE)], stdout=log,
+                                       stderr=subprocess.STDOUT)
+        log.close()
 
     def run(self):
         while True:
+            self.profiler.begin_frame()
+            self.camera.move((self.scrolling[1] - self.scrolling[0]) * 2, (self.scrolling[3] - self.scrolling[2]) * 2)
+            offset = self.camera.offset()
             self.display.fill((0, 0, 0))
-            self.tilemap.render(self.display)
+            self.tilemap.render(self.display, offset)
+            self.tilemap.light.render(self.display, offset)
+            self.profiler.mark('tilemap')
 
             current_tile_img = self.assets[self.tile_list[self.tile_group]].copy()
             current_tile_img.set_alpha(40)
 
             m_pos = pygame.mouse.get_pos()
-            m_pos = (m_pos[0] / RENDER_SCALE, m_pos[1] / RENDER_SCALE)
+            m_pos = (m_pos[0] / RENDER_SCALE + offset[0], m_pos[1] / RENDER_SCALE + offset[1])
             tile_pos = (int(m_pos[0] // self.tilemap.tile_size), int(m_pos[1] // self.tilemap.tile_size))
 
             if self.ongrid:
-                self.display.blit(current_tile_img,
-                                  (tile_pos[0] * self.tilemap.tile_size, tile_pos[1] * self.tilemap.tile_size))
+                self.display.blit(current_tile_img, (tile_pos[0] * self.tilemap.tile_size - offset[0],
+                                                     tile_pos[1] * self.tilemap.tile_size - offset[1]))
             else:
-                self.display.blit(current_tile_img, m_pos)
+                self.display.blit(current_tile_img, (m_pos[0] - offset[0], m_pos[1] - offset[1]))
 
-            if self.clicking and self.ongrid:
-                self.tilemap.tilemap[str(tile_pos[0]) + ';' + str(tile_pos[1])] = {
-                    'type': self.tile_list[self.tile_group], 'pos': tile_pos}
+            brush = BRUSHES[self.brush]
+            if self.anchor is not None:
+                start = (self.anchor[0] * self.tilemap.tile_size - offset[0],
+                         self.anchor[1] * self.tilemap.tile_size - offset[1])
+                end = (tile_pos[0] * self.tilemap.tile_size - offset[0],
+                       tile_pos[1] * self.tilemap.tile_size - offset[1])
+                area = pygame.Rect(min(start[0], end[0]), min(start[1], end[1]), abs(end[0] - start[0]),
+                                   abs(end[1] - start[1]))
+                area.width += self.tilemap.tile_size
+                area.height += self.tilemap.tile_size
+                pygame.draw.rect(self.display, (255, 255, 255), area, 1)
+            elif brush == 'pencil' and (self.clicking and self.ongrid or self.right_clicking):
+                self.paint(line_tiles(self.last_tile or tile_pos, tile_pos), erase=not self.clicking)
             if self.right_clicking:
-                tile_loc = str(tile_pos[0]) + ';' + str(tile_pos[1])
-                if tile_loc in self.tilemap.tilemap:
-                    del self.tilemap.tilemap[tile_loc]
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_img = self.assets[tile['type']]
-                    tile_r = pygame.Rect(tile['pos'][0], tile['pos'][1], tile_img.get_width(), tile_img.get_height())
-                    if tile_r.collidepoint(m_pos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                for tile in self.tilemap.offgrid_at(m_pos):
+                    self.history.remove_offgrid(tile)
+            self.last_tile = tile_pos
+            self.profiler.mark('edit')
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    if self.save_thread:
+                        self.save_thread.join()
+                    self.profiler.disable()
                     pygame.quit()
                     sys.exit()
 
                 if event.type == pygame.MOUSEBUTTONDOWN:
+                    if event.button in (1, 3) and not self.clicking and not self.right_clicking:
+                        self.history.begin()
+                        self.last_tile = None
+                        if brush == 'rect' and self.ongrid:
+                            self.anchor = tile_pos
+                        if brush == 'fill' and self.ongrid:
+                            self.paint(flood_tiles(self.tilemap, tile_pos), erase=event.button == 3)
                     if event.button == 1:
                         self.clicking = True
                         if not self.ongrid:
-                            self.tilemap.offgrid_tiles.append({'type': self.tile_list[self.tile_group], 'pos': m_pos})
+                            self.history.add_offgrid({'type': self.tile_list[self.tile_group], 'pos': m_pos})
                     if event.button == 3:
                         self.right_clicking = True
                     if event.button == 4:
@@ -97,19 +207,56 @@ class Editor:
                         self.tile_group = (self.tile_group + 1) % len(self.tile_list)
 
                 if event.type == pygame.MOUSEBUTTONUP:
-                    if event.button == 1:
+                    if event.button == 1 and self.clicking:
                         self.clicking = False
-                    if event.button == 3:
+                        self.release(tile_pos)
+                    if event.button == 3 and self.right_clicking:
                         self.right_clicking = False
+                        self.release(tile_pos, erase=True)
                 if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_LEFT:
+                        self.scrolling[0] = True
+                    if event.key == pygame.K_RIGHT:
+                        self.scrolling[1] = True
+                    if event.key == pygame.K_UP:
+                        self.scrolling[2] = True
+                    if event.key == pygame.K_DOWN:
+                        self.scrolling[3] = True
                     if event.key == pygame.K_s:
                         self.ongrid = not self.ongrid
+                    if event.key == pygame.K_b:
+                        self.brush = (self.brush + 1) % len(BRUSHES)
+                        pygame.display.set_caption('Editor - ' + BRUSHES[self.brush])
+                    if event.key == pygame.K_z and event.mod & pygame.KMOD_CTRL:
+                        if event.mod & pygame.KMOD_SHIFT:
+                            self.history.redo()
+                        else:
+                            self.history.undo()
+                    if event.key == pygame.K_y and event.mod & pygame.KMOD_CTRL:
+                        self.history.redo()
                     if event.key == pygame.K_o:
-                        self.tilemap.save('data/maps/' + str(MAP_SAVE) + '.json')
+                        if self.save_thread:
+                            self.save_thread.join()
+                        self.save_thread = self.tilemap.save('data/maps/' + str(MAP_SAVE) + '.json', background=True,
+                                                             done=self.saved)
+                    if event.key == pygame.K_F3:
+                        self.profiler.toggle()
+                if event.type == pygame.KEYUP:
+                    if event.key == pygame.K_LEFT:
+                        self.scrolling[0] = False
+                    if event.key == pygame.K_RIGHT:
+                        self.scrolling[1] = False
+                    if event.key == pygame.K_UP:
+                        self.scrolling[2] = False
+                    if event.key == pygame.K_DOWN:
+                        self.scrolling[3] = False
+            self.profiler.mark('events')
 
-            self.screen.blit(pygame.transform.scale(self.display, self.screen.get_size()), (0, 0))
-            pygame.display.update()
+            self.presenter.present([(self.profiler.render_overlay(), (10, 10))] if self.profiler.enabled else ())
+            self.profiler.mark('present')
+            self.profiler.end_frame()
             self.clock.tick(60)
 
 
-Editor().run()
+if __name__ == '__main__':
+    Editor().run()
@@ -0,0 +1,193 @@
+import time
+import random
+import argparse
+import multiprocessing
+from array import array
+
+from game import Game
+from scripts.inputs import INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP
+from scripts.levels import LevelCache
+
+
+ACTIONS = (0, INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP, INPUT_LEFT | INPUT_JUMP, INPUT_RIGHT | INPUT_JUMP)
+MAX_TICKS = 3600
+REWARD_EXIT = 1.0
+REWARD_DEATH = -1.0
+REWARD_TICK = 0.0
+
+
+class EnvGroup:
+    def __init__(self, levels, maps_dir='data/maps', frame_skip=1, max_ticks=MAX_TICKS):
+        self.levels = list(levels)
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        cache = LevelCache(maps_dir, capacity=len(set(self.levels)) + 1)
+        self.games = [Game(headless=True, level=level, maps_dir=maps_dir, levels=cache) for level in self.levels]
+        self.ticks = array('I', bytes(4 * len(self.games)))
+
+    def reset_game(self, i):
+        game = self.games[i]
+        level = self.levels[i]
+        if game.level != level or game.finished:
+            game.finished = False
+            game.level = level
+            game.load_level(level)
+        else:
+            game.restore(game.initial_state)
+        self.ticks[i] = 0
+
+    def reset(self):
+        for i in range(len(self.games)):
+            self.reset_game(i)
+        return [game.snapshot() for game in self.games]
+
+    def grids(self):
+        return [(game.tilemap.grid_origin, game.tilemap.grid_width, game.tilemap.grid_height, game.tilemap.grid,
+                 game.tilemap.tile_types) for game in self.games]
+
+    def step(self, actions):
+        observations = []
+        rewards = array('d')
+        dones = array('B')
+        for i, game in enumerate(self.games):
+            action = actions[i]
+            level = game.level
+            deaths = game.deaths
+            reward = 0.0
+            done = False
+            for tick in range(self.frame_skip):
+                game.step(action if tick == 0 else action & ~INPUT_JUMP)
+                self.ticks[i] += 1
+                reward += REWARD_TICK
+                if game.finished or game.level != level:
+                    reward += REWARD_EXIT
+                    done = True
+                elif game.deaths != deaths:
+                    reward += REWARD_DEATH
+                    done = True
+                elif self.ticks[i] >= self.max_ticks:
+                    done = True
+                if done:
+                    break
+            if done:
+                self.reset_game(i)
+            observations.append(game.snapshot())
+            rewards.append(reward)
+            dones.append(done)
+        return observations, rewards, dones
+
+
+def worker(conn, levels, maps_dir, frame_skip, max_ticks):
+    group = EnvGroup(levels, maps_dir, frame_skip, max_ticks)
+    while True:
+        command, data = conn.recv()
+        if command == 'step':
+            conn.send(group.step(data))
+        elif command == 'reset':
+            conn.send(group.reset())
+        elif command == 'grids':
+            conn.send(group.grids())
+        else:
+            break
+    conn.close()
+
+
+class VectorEnv:
+    def __init__(self, levels, maps_dir='data/maps', workers=0, frame_skip=1, max_ticks=MAX_TICKS):
+        self.levels = list(levels)
+        self.group = None
+        self.connections = []
+        self.processes = []
+        self.splits = []
+        if workers <= 1:
+            self.group = EnvGroup(self.levels, maps_dir, frame_skip, max_ticks)
+            return
+
+        context = multiprocessing.get_context('spawn')
+        workers = min(workers, len(self.levels))
+        for w in range(workers):
+            start = len(self.levels) * w // workers
+            end = len(self.levels) * (w + 1) // workers
+            conn, child = context.Pipe()
+            process = context.Process(target=worker, args=(child, self.levels[start:end], maps_dir, frame_skip,
+                                                           max_ticks), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(conn)
+            self.processes.append(process)
+            self.splits.append((start, end))
+
+    def __len__(self):
+        return len(self.levels)
+
+    def call(self, command, data=None):
+        for i, conn in enumerate(self.connections):
+            conn.send((command, data[self.splits[i][0]:self.splits[i][1]] if data is not None else None))
+        return [conn.recv() for conn in self.connections]
+
+    def reset(self):
+        if self.group:
+            return self.group.reset()
+        return [observation for part in self.call('reset') for observation in part]
+
+    def grids(self):
+        if self.group:
+            return self.group.grids()
+        return [grid for part in self.call('grids') for grid in part]
+
+    def step(self, actions):
+        if self.group:
+            return self.group.step(actions)
+        observations = []
+        rewards = array('d')
+        dones = array('B')
+        for part in self.call('step', actions):
+            observations.extend(part[0])
+            rewards.extend(part[1])
+            dones.extend(part[2])
+        return observations, rewards, dones
+
+    def close(self):
+        for conn in self.connections:
+            conn.send(('close', None))
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('levels', nargs='*', type=int)
+    parser.add_argument('--envs', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--frame-skip', type=int, default=4)
+    parser.add_argument('--max-ticks', type=int, default=MAX_TICKS)
+    parser.add_argument('--maps-dir', default='data/maps')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    levels = args.levels or [0]
+    rng = random.Random(args.seed)
+    env = VectorEnv([levels[i % len(levels)] for i in range(args.envs)], args.maps_dir, args.workers,
+                    args.frame_skip, args.max_ticks)
+    env.reset()
+    episodes = 0
+    solved = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        observations, rewards, dones = env.step([rng.choice(ACTIONS) for _ in range(len(env))])
+        episodes += sum(dones)
+        solved += sum(1 for reward in rewards if reward > 0)
+    elapsed = time.perf_counter() - start
+    env.close()
+
+    ticks = args.steps * args.frame_skip * len(env)
+    print(f'{len(env)} envs, {ticks} ticks in {elapsed:.2f}s ({ticks / elapsed:.0f} ticks/s), '
+          f'{episodes} episodes ({episodes / elapsed * 60:.0f}/min), {solved} solved')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,166 +1,397 @@
+import os
+import time
+import argparse
+from array import array
+from itertools import repeat
 import pygame
 
 
 from sys import exit
-from scripts.utils import load_image
-from scripts.entities import Player, Box, Enemy, Button, Door
+from scripts.inputs import INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP, INPUT_RESTART, INPUT_QUICK_SAVE, INPUT_QUICK_LOAD
+from scripts.inputs import pack_inputs
+from scripts.assets import AssetManager
+from scripts.levels import LevelCache
+from scripts.present import Presenter, PresentWorker, TextCache
+from scripts.profiler import FrameProfiler
+from scripts.replay import InputLog, load_log
+from scripts.signals import SignalBus
+from scripts.camera import Camera
+from scripts.entities import PhysicsEntity, Player, Box, Enemy, Button, Door
+from scripts.spatial import SpatialHash
+from scripts.streaming import ChunkStreamer, WORLD_FILE
 from scripts.tilemap import Tilemap
 
 
-class Game:
-    def __init__(self):
-        pygame.init()
+LEVEL_COUNT = 20
+FADE_DURATION = 0.43
+TICK_RATE = 60
+TICK_TIME = 1 / TICK_RATE
+FRAME_RATE = 144
+MAX_FRAME_TIME = 0.25
+PROFILE_PHASES = ('events', 'buttons', 'enemies', 'player', 'boxes', 'tilemap', 'entities', 'lighting', 'present')
+PROFILE_COUNTERS = ('tiles_around', 'physics_rects_around', 'rect_calls')
+
+
+def report_replay(log, game):
+    result = log.check(game)
+    if result is None:
+        print('replay finished, no expected state hash')
+    else:
+        print('replay state matches' if result else 'replay state MISMATCH')
+    return result
 
-        pygame.display.set_caption('Diploma')
-        self.screen = pygame.display.set_mode((960, 640))
+
+class Game:
+    def __init__(self, headless=False, level=0, maps_dir='data/maps', levels=None):
+        self.started = time.perf_counter()
+        self.first_frame_ms = None
+        self.headless = headless
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            pygame.display.init()
+            self.screen = pygame.display.set_mode((1, 1))
+        else:
+            pygame.display.init()
+            pygame.font.init()
+            pygame.display.set_caption('Diploma')
+            self.screen = pygame.display.set_mode((960, 640))
         self.display = pygame.Surface((480, 320))
+        self.camera = Camera(self.display.get_size())
+        self.presenter = None
+        self.present_worker = None
+        self.buffers = [self.display]
+        self.level_text = None
+        self.fades = 0
+        self.frame = 0
+        if not headless:
+            self.presenter = Presenter(self.screen, self.display)
+            self.present_worker = PresentWorker(self.presenter)
+            self.buffers.append(pygame.Surface(self.display.get_size()))
+            self.level_text = TextCache(64, (70, 130, 180))
         self.clock = pygame.time.Clock()
         self.movement = [False, False]
-        self.assets = {
-            'box': load_image('box.png'),
-            'exit': load_image('exit.png'),
-            'stone': load_image('stone.png'),
-            'enemy': load_image('enemy.png'),
-            'player': load_image('player.png'),
-            'spikes': load_image('spikes.png'),
-            'button_red': load_image('button_red.png'),
-            'button_red_pressed': load_image('button_red_pressed.png'),
-            'door_red': load_image('door_red.png'),
-            'door_red_open': load_image('door_red_open.png'),
-            'button_green': load_image('button_green.png'),
-            'button_green_pressed': load_image('button_green_pressed.png'),
-            'door_green': load_image('door_green.png'),
-            'door_green_open': load_image('door_green_open.png'),
-            'button_blue': load_image('button_blue.png'),
-            'button_blue_pressed': load_image('button_blue_pressed.png'),
-            'door_blue': load_image('door_blue.png'),
-            'door_blue_open': load_image('door_blue_open.png'),
-            'background': load_image('background.png'),
-            'tutorial': load_image('tutorial.png'),
-            'rip': load_image('rip.png'),
-            'torch': load_image('torch.png'),
-        }
+        self.assets = AssetManager()
         self.tilemap = Tilemap(self, tile_size=16)
-        self.level = 0
+        self.tilemap.listeners.append(self.wake_area)
+        self.levels = levels or LevelCache(maps_dir)
+        self.stream = None
+        self.profiler = FrameProfiler(PROFILE_PHASES, PROFILE_COUNTERS)
+        self.profiler.count_calls(Tilemap, 'tiles_around', 'tiles_around')
+        self.profiler.count_calls(Tilemap, 'physics_rects_around', 'physics_rects_around')
+        for entity_class in (PhysicsEntity, Button, Door):
+            self.profiler.count_calls(entity_class, 'rect', 'rect_calls')
+        self.level = level
+        self.ticks = 0
+        self.deaths = 0
+        self.finished = False
+        self.stepping = False
+        self.restart_pending = False
+        self.initial_state = None
+        self.saved_state = None
         self.boxes = []
         self.enemies = []
         self.buttons = []
         self.doors = []
+        self.entity_hash = SpatialHash(self.tilemap.tile_size)
+        self.trigger_hash = SpatialHash(self.tilemap.tile_size)
+        self.signals = SignalBus()
+        self.dirty_buttons = []
+        self.wake_rect = pygame.Rect(0, 0, 0, 0)
+        self.wake_buffer = []
+        self.trigger_buffer = []
         self.player = Player(self, (0, 0), (16, 16))
 
-        pygame.mixer.music.load("data/music/background_music.mp3")
-        pygame.mixer.music.set_volume(0.05)
-        pygame.mixer.music.play(-1)
-        self.music_on = True
+        self.music_on = False
+        if not headless:
+            self.assets.start_music('data/music/background_music.mp3', 0.05)
+            self.music_on = True
 
         self.load_level(self.level)
 
     def load_level(self, map_id):
-        self.tilemap.load('data/maps/' + str(map_id) + '.json')
+        if self.stream:
+            self.stream.stop()
+            self.stream = None
+
+        world_dir = os.path.join(self.levels.maps_dir, str(map_id))
+        if os.path.exists(os.path.join(world_dir, WORLD_FILE)):
+            self.stream = ChunkStreamer(self.tilemap, world_dir)
+            level_data = self.stream.level_data
+        else:
+            level_data = self.levels.get(map_id)
+        self.levels.prefetch(map_id + 1)
+        self.tilemap.load_data(level_data)
+        self.signals = SignalBus(level_data.get('wiring', ()))
         self.boxes = []
         self.enemies = []
         self.buttons = []
         self.doors = []
-        for tile_pos in list(self.tilemap.tilemap):
-            tile = self.tilemap.tilemap[tile_pos]
-            pos = (tile['pos'][0] * self.tilemap.tile_size, tile['pos'][1] * self.tilemap.tile_size)
-            size = (self.tilemap.tile_size,) * 2
+        size = (self.tilemap.tile_size,) * 2
+        for tile_type, tile_pos in level_data['spawns']:
+            pos = (tile_pos[0] * self.tilemap.tile_size, tile_pos[1] * self.tilemap.tile_size)
 
-            if tile['type'] == 'player':
+            if tile_type == 'player':
                 self.player = Player(self, pos, size)
-                self.tilemap.tilemap.pop(tile_pos)
-            elif tile['type'] == 'box':
+            elif tile_type == 'box':
                 self.boxes.append(Box(self, pos, size))
-                self.tilemap.tilemap.pop(tile_pos)
-            elif tile['type'] == 'enemy':
+            elif tile_type == 'enemy':
                 self.enemies.append(Enemy(self, pos, size))
-                self.tilemap.tilemap.pop(tile_pos)
-            if tile['type'].startswith('button_'):
-                color = tile['type'].split('_')[1]
-                self.buttons.append(Button(self, pos, size, color))
-                self.tilemap.tilemap.pop(tile_pos)
-            elif tile['type'].startswith('door_'):
-                color = tile['type'].split('_')[1]
-                self.doors.append(Door(self, pos, size, color))
-                self.tilemap.tilemap.pop(tile_pos)
-
-    def fade(self, direction='in'):
-        fade = pygame.Surface(self.display.get_size())
-        fade.fill((0, 0, 0))
+            elif tile_type.startswith('button_'):
+                self.buttons.append(Button(self, pos, size, tile_type.split('_')[1]))
+            elif tile_type.startswith('door_'):
+                self.doors.append(Door(self, pos, size, tile_type.split('_')[1]))
+        if self.stream:
+            self.stream.update(self.player.pos)
 
-        if direction == 'in':
-            alpha_range = range(0, 255, 10)
-        elif direction == 'out':
-            alpha_range = range(255, 0, -10)
-        else:
+        self.entity_hash = SpatialHash(self.tilemap.tile_size)
+        for box in self.boxes:
+            self.entity_hash.insert(box)
+        self.entity_hash.insert(self.player)
+        for enemy in self.enemies:
+            self.entity_hash.insert(enemy)
+        self.trigger_hash = SpatialHash(self.tilemap.tile_size)
+        for button in self.buttons:
+            self.trigger_hash.insert(button)
+        self.dirty_buttons = list(self.buttons)
+        self.camera.set_bounds(self.tilemap.pixel_bounds(), self.tilemap.tile_size)
+        self.camera.snap(self.player.rect())
+        self.store_positions()
+        self.initial_state = self.snapshot()
+
+    def snapshot(self):
+        state = array('d', [self.level])
+        state.extend((self.player.pos[0], self.player.pos[1], self.player.velocity[0], self.player.velocity[1],
+                      self.player.jumps))
+        for box in self.boxes:
+            if box.sleeping:
+                box.sync()
+            state.extend((box.pos[0], box.pos[1], box.velocity[0], box.velocity[1]))
+        for enemy in self.enemies:
+            state.extend((enemy.pos[0], enemy.pos[1], enemy.velocity[0], enemy.velocity[1], enemy.direction))
+        state.extend([button.pressed for button in self.buttons])
+        state.extend([door.open for door in self.doors])
+        state.extend(self.signals.state())
+        return state
+
+    def restore(self, state):
+        if state[0] != self.level:
+            raise ValueError('snapshot belongs to another level')
+
+        player = self.player
+        player.pos[0], player.pos[1], player.velocity[0], player.velocity[1] = state[1:5]
+        player.jumps = int(state[5])
+        player.moved()
+        i = 6
+        for box in self.boxes:
+            box.wake()
+            box.pos[0], box.pos[1], box.velocity[0], box.velocity[1] = state[i:i + 4]
+            box.moved()
+            i += 4
+        for enemy in self.enemies:
+            enemy.pos[0], enemy.pos[1], enemy.velocity[0], enemy.velocity[1] = state[i:i + 4]
+            enemy.direction = int(state[i + 4])
+            enemy.moved()
+            i += 5
+        for button in self.buttons:
+            button.pressed = bool(state[i])
+            button.dirty = True
+            i += 1
+        for door in self.doors:
+            door.open = bool(state[i])
+            i += 1
+        self.signals.restore(state[i:], self.buttons)
+        self.dirty_buttons.clear()
+        self.dirty_buttons.extend(self.buttons)
+        self.camera.snap(player.rect())
+        self.store_positions()
+
+    def store_positions(self):
+        self.player.store_position()
+        for box in self.boxes:
+            box.store_position()
+        for enemy in self.enemies:
+            enemy.store_position()
+
+    def wake_area(self, rect, source=None):
+        if not self.boxes:
+            return
+        margin = self.tilemap.tile_size * 2
+        self.wake_rect.update(rect)
+        self.wake_rect.inflate_ip(margin, margin)
+        for box in self.entity_hash.query(self.wake_rect, ('box',), self.wake_buffer):
+            if box is not source:
+                box.wake()
+
+    def mark_buttons(self, rect):
+        for button in self.trigger_hash.query(rect, None, self.trigger_buffer):
+            if not button.dirty:
+                button.dirty = True
+                self.dirty_buttons.append(button)
+
+    def quick_save(self):
+        self.saved_state = self.snapshot()
+
+    def quick_load(self):
+        if self.saved_state and self.saved_state[0] == self.level:
+            self.restore(self.saved_state)
+
+    def fade(self, direction='in', loading=None):
+        if self.headless or direction not in ('in', 'out'):
+            if loading:
+                loading.join()
             return
 
-        for alpha in alpha_range:
-            self.display.blit(self.assets['background'], (0, 0))
-            self.tilemap.render(self.display)
-            for button in self.buttons:
-                button.render(self.display)
-            for door in self.doors:
-                door.render(self.display)
-            for enemy in self.enemies:
-                enemy.render(self.display)
-            self.player.render(self.display)
-            for box in self.boxes:
-                box.render(self.display)
-            fade.set_alpha(alpha)
-            self.display.blit(fade, (0, 0))
-            self.screen.blit(pygame.transform.scale(self.display, self.screen.get_size()), (0, 0))
+        if self.present_worker:
+            self.present_worker.flip()
+        self.fades += 1
+        self.render()
+        scene = pygame.transform.scale(self.display, self.screen.get_size())
+        fade = pygame.Surface(self.screen.get_size())
+        fade.fill((0, 0, 0))
+
+        start = time.perf_counter()
+        while True:
+            progress = min(1, (time.perf_counter() - start) / FADE_DURATION)
+            alpha = progress if direction == 'in' else 1 - progress
+            fade.set_alpha(int(alpha * 255))
+            self.screen.blit(scene, (0, 0))
+            self.screen.blit(fade, (0, 0))
             pygame.display.update()
+            pygame.event.pump()
+            if progress >= 1 and not (loading and loading.is_alive()):
+                break
             self.clock.tick(60)
 
     def restart_level(self):
+        if self.stepping:
+            self.restart_pending = True
+            return
+
+        self.deaths += 1
         self.fade('in')
-        self.load_level(self.level)
+        self.restore(self.initial_state)
         self.fade('out')
 
     def next_level(self):
-        self.fade('in')
+        self.fade('in', self.levels.prefetch(self.level + 1))
         self.level += 1
-        if self.level >= 20:
-            pygame.quit()
-            exit()
+        if self.level >= LEVEL_COUNT:
+            self.finished = True
+            return
         self.load_level(self.level)
         self.fade('out')
 
-    def run(self):
-        while True:
-            self.display.blit((self.assets['background']), (0, 0))
-            self.tilemap.render(self.display)
-
-            for button in self.buttons:
-                button.update()
-                button.render(self.display)
-            for door in self.doors:
-                door.update()
-                door.render(self.display)
-            for enemy in self.enemies:
-                enemy.update(self.tilemap, (self.movement[1] - self.movement[0], 0))
-                enemy.render(self.display)
-            self.player.update(self.tilemap, (self.movement[1] - self.movement[0], 0))
-            self.player.render(self.display)
-            for box in self.boxes:
-                box.update(self.tilemap, (self.movement[1] - self.movement[0], 0))
-                box.render(self.display)
+    def step(self, inputs=0):
+        self.movement[0] = bool(inputs & INPUT_LEFT)
+        self.movement[1] = bool(inputs & INPUT_RIGHT)
+        if inputs & INPUT_QUICK_SAVE:
+            self.quick_save()
+        if inputs & INPUT_QUICK_LOAD:
+            self.quick_load()
+        if inputs & INPUT_RESTART:
+            self.restart_level()
+        if inputs & INPUT_JUMP:
+            self.player.jump()
+
+        if self.stream:
+            self.stream.update(self.player.pos)
+
+        movement = (self.movement[1] - self.movement[0], 0)
+        self.signals.tick()
+        for button in self.dirty_buttons:
+            button.update()
+        self.dirty_buttons.clear()
+        self.profiler.mark('buttons')
+        for enemy in self.enemies:
+            if self.stream and not self.stream.is_active(enemy.pos):
+                continue
+            enemy.update(self.tilemap, movement)
+        self.profiler.mark('enemies')
+        self.stepping = True
+        self.player.update(self.tilemap, movement)
+        self.stepping = False
+        if self.restart_pending:
+            self.restart_pending = False
+            self.restart_level()
+        self.profiler.mark('player')
+        for box in self.boxes:
+            if self.stream and not self.stream.is_active(box.pos):
+                continue
+            box.update(self.tilemap, movement)
+        self.profiler.mark('boxes')
+        self.ticks += 1
+
+    def render(self, alpha=1.0):
+        offset = self.camera.offset(alpha)
+        self.display.blit((self.assets['background']), (0, 0))
+        self.tilemap.render(self.display, offset)
+        self.profiler.mark('tilemap')
+        for button in self.buttons:
+            button.render(self.display, offset)
+        for door in self.doors:
+            door.render(self.display, offset)
+        for enemy in self.enemies:
+            enemy.render(self.display, offset, alpha)
+        self.player.render(self.display, offset, alpha)
+        for box in self.boxes:
+            box.render(self.display, offset, alpha)
+        self.profiler.mark('entities')
+        self.tilemap.light.render(self.display, offset)
+        self.profiler.mark('lighting')
 
+    def run_headless(self, ticks, inputs=0):
+        self.play(repeat(inputs, ticks))
+
+    def play(self, inputs):
+        for tick_inputs in inputs:
+            if self.finished:
+                break
+            self.profiler.begin_frame()
+            self.step(tick_inputs)
+            self.profiler.end_frame()
+
+    def quit(self, recording=None, replay=None, record_path=None):
+        if self.present_worker:
+            self.present_worker.flip()
+        self.profiler.disable()
+        if recording:
+            recording.save(record_path, self)
+            print(f'recorded {len(recording.inputs)} ticks to {record_path}')
+        if replay:
+            report_replay(replay, self)
+        pygame.quit()
+        exit()
+
+    def run(self, record_path=None, replay=None):
+        recording = InputLog(self.level) if record_path else None
+        replay_inputs = iter(replay.inputs) if replay else None
+        jump = False
+        restart = False
+        quick_save = False
+        quick_load = False
+        previous = time.perf_counter()
+        lag = TICK_TIME
+        while True:
+            self.profiler.begin_frame()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
-                    exit()
+                    self.quit(recording, replay, record_path)
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_LEFT or event.key == pygame.K_a:
                         self.movement[0] = True
                     if event.key == pygame.K_RIGHT or event.key == pygame.K_d:
                         self.movement[1] = True
                     if event.key == pygame.K_UP or event.key == pygame.K_w or event.key == pygame.K_SPACE:
-                        self.player.jump()
+                        jump = True
                     if event.key == pygame.K_r:
-                        self.restart_level()
-                    if event.key == pygame.K_m:
+                        restart = True
+                    if event.key == pygame.K_F5:
+                        quick_save = True
+                    if event.key == pygame.K_F9:
+                        quick_load = True
+                    if event.key == pygame.K_F3:
+                        self.profiler.toggle()
+                    if event.key == pygame.K_m and self.assets.music_ready:
                         if self.music_on:
                             pygame.mixer.music.pause()
                         else:
@@ -172,11 +403,78 @@ class Game:
                     if event.key == pygame.K_RIGHT or event.key == pygame.K_d:
                         self.movement[1] = False
 
-            self.screen.blit(pygame.transform.scale(self.display, self.screen.get_size()), (0, 0))
-            self.screen.blit(pygame.font.SysFont(None, 64).render(f'{self.level + 1}', True, (70, 130, 180)),
-                             (900, 10))
-            pygame.display.update()
-            self.clock.tick(60)
+            self.profiler.mark('events')
+
+            now = time.perf_counter()
+            lag += min(MAX_FRAME_TIME, now - previous)
+            previous = now
+            while lag >= TICK_TIME:
+                lag -= TICK_TIME
+                inputs = pack_inputs(self.movement, jump, restart, quick_save, quick_load)
+                if replay_inputs:
+                    inputs = next(replay_inputs, None)
+                    if inputs is None:
+                        self.quit(replay=replay)
+                if recording:
+                    recording.record(inputs)
+                fades = self.fades
+                self.store_positions()
+                self.step(inputs)
+                self.camera.follow(self.player.rect())
+                if self.finished:
+                    self.quit(recording, replay, record_path)
+                jump = False
+                restart = False
+                quick_save = False
+                quick_load = False
+                if self.fades != fades:
+                    self.camera.snap(self.player.rect())
+                    previous = time.perf_counter()
+                    lag = 0.0
+
+            self.present_worker.flip()
+            self.render(lag / TICK_TIME)
+            overlays = [(self.level_text.render(f'{self.level + 1}'), (900, 10))]
+            if self.profiler.enabled:
+                overlays.append((self.profiler.render_overlay(), (10, 10)))
+            self.present_worker.submit(self.display, overlays)
+            self.frame += 1
+            self.display = self.buffers[self.frame % len(self.buffers)]
+            if self.first_frame_ms is None:
+                self.first_frame_ms = (time.perf_counter() - self.started) * 1000
+                print(f'first frame after {self.first_frame_ms:.0f} ms')
+            self.profiler.mark('present')
+            self.profiler.end_frame()
+            self.clock.tick(FRAME_RATE)
 
 
-Game().run()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--level', type=int, default=0)
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--ticks', type=int, default=3600)
+    parser.add_argument('--record')
+    parser.add_argument('--replay')
+    args = parser.parse_args()
+
+    if args.replay:
+        log = load_log(args.replay)
+        if args.headless:
+            game = Game(headless=True, level=log.level)
+            start = time.perf_counter()
+            game.play(log.inputs)
+            elapsed = time.perf_counter() - start
+            print(f'replayed {game.ticks} ticks in {elapsed:.2f}s ({game.ticks / elapsed:.0f} ticks/s)')
+            if report_replay(log, game) is False:
+                exit(1)
+        else:
+            Game(level=log.level).run(replay=log)
+    elif args.headless:
+        for level in range(args.level, LEVEL_COUNT):
+            game = Game(headless=True, level=level)
+            start = time.perf_counter()
+            game.run_headless(args.ticks)
+            elapsed = time.perf_counter() - start
+            print(f'level {level}: {game.ticks} ticks, {game.deaths} deaths, {game.ticks / elapsed:.0f} ticks/s')
+    else:
+        Game(level=args.level).run(record_path=args.record)
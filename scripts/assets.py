@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import threading
+import pygame
+
+from scripts.signals import CHANNEL_COLORS
+from scripts.utils import tint_image
+
+
+IMAGE_DIR = 'data/images'
+CACHE_DIR = 'data/cache'
+ATLAS_IMAGE = 'atlas.bmp'
+ATLAS_INDEX = 'atlas.json'
+ATLAS_WIDTH = 512
+TINTED_SPRITES = ('button_{}', 'button_{}_pressed', 'door_{}', 'door_{}_open')
+TINT_SOURCE = 'red'
+
+
+def image_sources(image_dir=IMAGE_DIR):
+    return {name[:-4]: os.path.join(image_dir, name) for name in sorted(os.listdir(image_dir)) if name.endswith('.png')}
+
+
+def source_stamps(sources):
+    stamps = {}
+    for name, path in sources.items():
+        stat = os.stat(path)
+        stamps[name] = [stat.st_mtime_ns, stat.st_size]
+    return stamps
+
+
+def pack(sizes, width=ATLAS_WIDTH):
+    rects = {}
+    x = 0
+    y = 0
+    shelf = 0
+    for name in sorted(sizes, key=lambda name: (-sizes[name][1], name)):
+        w, h = sizes[name]
+        if x + w > width:
+            x = 0
+            y += shelf
+            shelf = 0
+        rects[name] = [x, y, w, h]
+        x += w
+        shelf = max(shelf, h)
+    return rects, y + shelf
+
+
+def build_atlas(image_dir=IMAGE_DIR, cache_dir=CACHE_DIR):
+    sources = image_sources(image_dir)
+    images = {name: pygame.image.load(path).convert() for name, path in sources.items()}
+    width = max([ATLAS_WIDTH] + [img.get_width() for img in images.values()])
+    rects, height = pack({name: img.get_size() for name, img in images.items()}, width)
+    atlas = pygame.Surface((width, height)).convert()
+    atlas.fill((0, 0, 0))
+    for name, rect in rects.items():
+        atlas.blit(images[name], rect[:2])
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        pygame.image.save(atlas, os.path.join(cache_dir, ATLAS_IMAGE))
+        f = open(os.path.join(cache_dir, ATLAS_INDEX), 'w')
+        json.dump({'sources': source_stamps(sources), 'rects': rects}, f)
+        f.close()
+    except (OSError, pygame.error):
+        pass
+    return atlas, rects
+
+
+def load_atlas(image_dir=IMAGE_DIR, cache_dir=CACHE_DIR):
+    try:
+        f = open(os.path.join(cache_dir, ATLAS_INDEX), 'r')
+        index = json.load(f)
+        f.close()
+        if index['sources'] == source_stamps(image_sources(image_dir)):
+            return pygame.image.load(os.path.join(cache_dir, ATLAS_IMAGE)).convert(), index['rects']
+    except (OSError, ValueError, KeyError, pygame.error):
+        pass
+    return build_atlas(image_dir, cache_dir)
+
+
+class AssetManager(dict):
+    def __init__(self, image_dir=IMAGE_DIR, cache_dir=CACHE_DIR):
+        super().__init__()
+        self.atlas, self.rects = load_atlas(image_dir, cache_dir)
+        self.atlas.set_colorkey((0, 0, 0))
+        self.tints = {}
+        for color, tint in CHANNEL_COLORS.items():
+            for sprite in TINTED_SPRITES:
+                self.tints[sprite.format(color)] = (sprite.format(TINT_SOURCE), tint)
+        self.music_thread = None
+        self.music_ready = False
+
+    def __missing__(self, name):
+        if name in self.rects:
+            img = self.atlas.subsurface(self.rects[name])
+        elif name in self.tints:
+            source, tint = self.tints[name]
+            img = tint_image(self[source], tint)
+        else:
+            raise KeyError(name)
+        self[name] = img
+        return img
+
+    def start_music(self, path, volume):
+        self.music_thread = threading.Thread(target=self.load_music, args=(path, volume), daemon=True)
+        self.music_thread.start()
+        return self.music_thread
+
+    def load_music(self, path, volume):
+        try:
+            pygame.mixer.init()
+            pygame.mixer.music.load(path)
+            pygame.mixer.music.set_volume(volume)
+            pygame.mixer.music.play(-1)
+            self.music_ready = True
+        except pygame.error as error:
+            print('music disabled:', error)
+
+
+if __name__ == '__main__':
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    atlas, rects = build_atlas(*sys.argv[1:3])
+    print(f'packed {len(rects)} images into a {atlas.get_width()}x{atlas.get_height()} atlas')
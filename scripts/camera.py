@@ -0,0 +1,48 @@
+class Camera:
+    def __init__(self, size, smoothing=10):
+        self.size = size
+        self.smoothing = smoothing
+        self.scroll = [0.0, 0.0]
+        self.prev_scroll = [0.0, 0.0]
+        self.limits = None
+
+    def set_bounds(self, bounds, margin=0):
+        # The outermost ring of tiles is a border that may stay offscreen, so maps that fit one screen never scroll.
+        bounds = bounds.inflate(-margin * 2, -margin * 2)
+        self.limits = (
+            (min(0, bounds.left), max(0, bounds.right - self.size[0])),
+            (min(0, bounds.top), max(0, bounds.bottom - self.size[1])),
+        )
+
+    def clamp(self):
+        if self.limits is None:
+            return
+        for axis in range(2):
+            low, high = self.limits[axis]
+            self.scroll[axis] = max(low, min(high, self.scroll[axis]))
+
+    def target(self, rect):
+        return rect.centerx - self.size[0] / 2, rect.centery - self.size[1] / 2
+
+    def snap(self, rect):
+        self.scroll[0], self.scroll[1] = self.target(rect)
+        self.clamp()
+        self.prev_scroll[0], self.prev_scroll[1] = self.scroll
+
+    def follow(self, rect):
+        self.prev_scroll[0], self.prev_scroll[1] = self.scroll
+        target = self.target(rect)
+        self.scroll[0] += (target[0] - self.scroll[0]) / self.smoothing
+        self.scroll[1] += (target[1] - self.scroll[1]) / self.smoothing
+        self.clamp()
+
+    def move(self, dx, dy):
+        self.scroll[0] += dx
+        self.scroll[1] += dy
+        self.clamp()
+
+    def offset(self, alpha=1.0):
+        if alpha >= 1:
+            return int(self.scroll[0]), int(self.scroll[1])
+        return (int(self.prev_scroll[0] + (self.scroll[0] - self.prev_scroll[0]) * alpha),
+                int(self.prev_scroll[1] + (self.scroll[1] - self.prev_scroll[1]) * alpha))
@@ -1,55 +1,97 @@
 import pygame
+from collections import deque
+
+
+SLEEP_TICKS = 30
+MAX_CYCLE = 8
+COLLIDE_UP = 1
+COLLIDE_DOWN = 2
+COLLIDE_RIGHT = 4
+COLLIDE_LEFT = 8
+COLLIDE_VERTICAL = COLLIDE_UP | COLLIDE_DOWN
+COLLIDE_HORIZONTAL = COLLIDE_LEFT | COLLIDE_RIGHT
 
 
 class PhysicsEntity:
+    __slots__ = ('game', 'type', 'pos', 'size', 'velocity', 'collisions', 'bounds', 'probe', 'area', 'last_rect',
+                 'nearby', 'prev_pos')
+
     def __init__(self, game, e_type, pos, size):
         self.game = game
         self.type = e_type
         self.pos = list(pos)
         self.size = size
         self.velocity = [0, 0]
-        self.collisions = {'up': False, 'down': False, 'right': False, 'left': False}
+        self.collisions = 0
+        self.bounds = pygame.Rect(self.pos[0], self.pos[1], size[0], size[1])
+        self.probe = pygame.Rect(self.bounds)
+        self.area = pygame.Rect(self.bounds)
+        self.last_rect = pygame.Rect(self.bounds)
+        self.nearby = []
+        self.prev_pos = list(pos)
 
     def rect(self):
-        return pygame.Rect(self.pos[0], self.pos[1], self.size[0], self.size[1])
+        self.bounds.update(self.pos[0], self.pos[1], self.size[0], self.size[1])
+        return self.bounds
+
+    def moved(self):
+        entity_rect = self.rect()
+        if entity_rect != self.last_rect:
+            self.game.wake_area(entity_rect, self)
+            self.area.update(self.last_rect)
+            self.area.union_ip(entity_rect)
+            self.game.mark_buttons(self.area)
+            self.last_rect.update(entity_rect)
+        self.game.entity_hash.move(self)
 
     def update(self, tilemap, movement=(0, 0)):
-        self.collisions = {'up': False, 'down': False, 'right': False, 'left': False}
-        frame_movement = [movement[0] + self.velocity[0], movement[1] + self.velocity[1]]
+        self.collisions = 0
+        move_x = movement[0] + self.velocity[0]
+        move_y = movement[1] + self.velocity[1]
 
-        self.pos[0] += frame_movement[0]
+        self.pos[0] += move_x
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
+        for rect in tilemap.physics_rects_around(self.pos, 0, self.nearby):
             if entity_rect.colliderect(rect):
-                if frame_movement[0] > 0:
+                if move_x > 0:
                     entity_rect.right = rect.left
-                    self.collisions['right'] = True
-                elif frame_movement[0] < 0:
+                    self.collisions |= COLLIDE_RIGHT
+                elif move_x < 0:
                     entity_rect.left = rect.right
-                    self.collisions['left'] = True
+                    self.collisions |= COLLIDE_LEFT
                 self.pos[0] = entity_rect.x
 
-        self.pos[1] += frame_movement[1]
+        self.pos[1] += move_y
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
+        for rect in tilemap.physics_rects_around(self.pos, 1, self.nearby):
             if entity_rect.colliderect(rect):
-                if frame_movement[1] > 0:
+                if move_y > 0:
                     entity_rect.bottom = rect.top
-                    self.collisions['down'] = True
-                elif frame_movement[1] < 0:
+                    self.collisions |= COLLIDE_DOWN
+                elif move_y < 0:
                     entity_rect.top = rect.bottom
-                    self.collisions['up'] = True
+                    self.collisions |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
         self.velocity[1] = min(5, self.velocity[1] + 0.1)
-        if self.collisions['down'] or self.collisions['up']:
+        if self.collisions & COLLIDE_VERTICAL:
             self.velocity[1] = 0
 
-    def render(self, surf):
-        surf.blit(self.game.assets[self.type], self.pos)
+    def store_position(self):
+        self.prev_pos[0] = self.pos[0]
+        self.prev_pos[1] = self.pos[1]
+
+    def render(self, surf, offset=(0, 0), alpha=1.0):
+        x, y = self.pos[0], self.pos[1]
+        if alpha < 1:
+            x = self.prev_pos[0] + (x - self.prev_pos[0]) * alpha
+            y = self.prev_pos[1] + (y - self.prev_pos[1]) * alpha
+        surf.blit(self.game.assets[self.type], (x - offset[0], y - offset[1]))
 
 
 class Player(PhysicsEntity):
+    __slots__ = ('jumps',)
+
     def __init__(self, game, pos, size):
         super().__init__(game, 'player', pos, size)
         self.size = size
@@ -57,9 +99,11 @@ class Player(PhysicsEntity):
 
     def update(self, tilemap, movement=(0, 0)):
         dx = movement[0]
-        future_rect = self.rect().move(dx, 0)
+        future_rect = self.probe
+        future_rect.update(self.rect())
+        future_rect.move_ip(dx, 0)
 
-        for box in self.game.boxes:
+        for box in self.game.entity_hash.query(future_rect, ('box',), self.nearby):
             if future_rect.colliderect(box.rect()):
                 if not box.try_push(dx):
                     dx = 0
@@ -73,35 +117,38 @@ class Player(PhysicsEntity):
         super().update(tilemap, movement=(dx, 0))
 
         entity_rect = self.rect()
-        for box in self.game.boxes:
+        self.area.update(entity_rect)
+        self.area.inflate_ip(0, self.size[1] * 2)
+        for box in self.game.entity_hash.query(self.area, ('box',), self.nearby):
             if entity_rect.colliderect(box.rect()):
                 if self.velocity[1] > 0:
                     entity_rect.bottom = box.rect().top
-                    self.collisions['down'] = True
+                    self.collisions |= COLLIDE_DOWN
                 elif self.velocity[1] < 0:
                     entity_rect.top = box.rect().bottom
-                    self.collisions['up'] = True
+                    self.collisions |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
         for door in self.game.doors:
             if not door.open and entity_rect.colliderect(door.rect()):
                 if self.velocity[1] > 0:
                     entity_rect.bottom = door.rect().top
-                    self.collisions['down'] = True
+                    self.collisions |= COLLIDE_DOWN
                 elif self.velocity[1] < 0:
                     entity_rect.top = door.rect().bottom
-                    self.collisions['up'] = True
+                    self.collisions |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
-        if self.collisions['down'] or self.collisions['up']:
+        if self.collisions & COLLIDE_VERTICAL:
             self.velocity[1] = 0
 
-        if self.collisions['down']:
+        if self.collisions & COLLIDE_DOWN:
             self.jumps = 1
 
         player_rect = self.rect()
-        for tile in tilemap.tiles_around(self.pos):
-            tile_rect = pygame.Rect(
+        tile_rect = self.probe
+        for tile in tilemap.tiles_around(self.pos, self.nearby):
+            tile_rect.update(
                 tile['pos'][0] * tilemap.tile_size,
                 tile['pos'][1] * tilemap.tile_size,
                 tilemap.tile_size,
@@ -114,7 +161,10 @@ class Player(PhysicsEntity):
                 elif tile['type'] == 'exit':
                     self.game.next_level()
 
-        for enemy in self.game.enemies:
+        self.moved()
+
+        player_rect = self.rect()
+        for enemy in self.game.entity_hash.query(player_rect, ('enemy',), self.nearby):
             if self.rect().colliderect(enemy.rect()):
                 self.game.restart_level()
 
@@ -125,19 +175,23 @@ class Player(PhysicsEntity):
 
 
 class Enemy(PhysicsEntity):
+    __slots__ = ('direction',)
+
     def __init__(self, game, pos, size):
         super().__init__(game, 'enemy', pos, size)
         self.direction = 1
 
     def update(self, tilemap, movement=(0, 0)):
-        future_rect = self.rect().move(self.direction, 0)
-        for box in self.game.boxes:
+        future_rect = self.probe
+        future_rect.update(self.rect())
+        future_rect.move_ip(self.direction, 0)
+        for box in self.game.entity_hash.query(future_rect, ('box',), self.nearby):
             if future_rect.colliderect(box.rect()):
                 if not box.try_push(self.direction):
                     self.direction *= -1
                     return
 
-        for enemy in self.game.enemies:
+        for enemy in self.game.entity_hash.query(future_rect, ('enemy',), self.nearby):
             if enemy is not self and future_rect.colliderect(enemy.rect()):
                 self.direction *= -1
                 return
@@ -150,41 +204,75 @@ class Enemy(PhysicsEntity):
         super().update(tilemap, (self.direction, 0))
 
         entity_rect = self.rect()
-        for other in self.game.boxes + self.game.enemies:
+        self.area.update(entity_rect)
+        self.area.inflate_ip(0, self.size[1] * 2)
+        for other in self.game.entity_hash.query(self.area, ('box', 'enemy'), self.nearby):
             if other is not self and entity_rect.colliderect(other.rect()):
                 if self.velocity[1] > 0:
                     entity_rect.bottom = other.rect().top
-                    self.collisions['down'] = True
+                    self.collisions |= COLLIDE_DOWN
                 elif self.velocity[1] < 0:
                     entity_rect.top = other.rect().bottom
-                    self.collisions['up'] = True
+                    self.collisions |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
         for door in self.game.doors:
             if not door.open and entity_rect.colliderect(door.rect()):
                 if self.velocity[1] > 0:
                     entity_rect.bottom = door.rect().top
-                    self.collisions['down'] = True
+                    self.collisions |= COLLIDE_DOWN
                 elif self.velocity[1] < 0:
                     entity_rect.top = door.rect().bottom
-                    self.collisions['up'] = True
+                    self.collisions |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
-        if self.collisions['down'] or self.collisions['up']:
+        if self.collisions & COLLIDE_VERTICAL:
             self.velocity[1] = 0
 
-        if self.collisions['left'] or self.collisions['right']:
+        if self.collisions & COLLIDE_HORIZONTAL:
             self.direction *= -1
 
+        self.moved()
+
 
 class Box(PhysicsEntity):
+    __slots__ = ('sleeping', 'sleep_ticks', 'cycle', 'history')
+
     def __init__(self, game, pos, size):
         super().__init__(game, 'box', pos, size)
+        self.sleeping = False
+        self.sleep_ticks = 0
+        self.cycle = None
+        self.history = deque(maxlen=SLEEP_TICKS)
+
+    def sync(self):
+        state = self.cycle[(self.sleep_ticks - 1) % len(self.cycle)]
+        self.pos[0], self.pos[1], self.velocity[0], self.velocity[1] = state
+
+    def wake(self):
+        if self.sleeping:
+            self.sync()
+            self.sleeping = False
+        self.history.clear()
+
+    def settle(self):
+        history = self.history
+        history.append((self.pos[0], self.pos[1], self.velocity[0], self.velocity[1]))
+        if len(history) < SLEEP_TICKS:
+            return
+        for period in range(1, MAX_CYCLE + 1):
+            if all(history[i] == history[i - period] for i in range(period, SLEEP_TICKS)):
+                self.cycle = list(history)[-period:]
+                self.sleeping = True
+                self.sleep_ticks = 0
+                return
 
     def try_push(self, dx):
-        future_rect = self.rect().move(dx, 0)
+        future_rect = self.probe
+        future_rect.update(self.rect())
+        future_rect.move_ip(dx, 0)
 
-        for entity in self.game.boxes + self.game.enemies + [self.game.player]:
+        for entity in self.game.entity_hash.query(future_rect, None, self.nearby):
             if entity is not self and future_rect.colliderect(entity.rect()):
                 return False
 
@@ -192,77 +280,104 @@ class Box(PhysicsEntity):
             if not door.open and future_rect.colliderect(door.rect()):
                 return False
 
-        for rect in self.game.tilemap.physics_rects_around((future_rect.x, future_rect.y)):
+        for rect in self.game.tilemap.physics_rects_around(future_rect, 0, self.nearby):
             if future_rect.colliderect(rect):
                 return False
 
+        self.wake()
         self.pos[0] += dx
+        self.moved()
         return True
 
     def update(self, tilemap, movement=(0, 0)):
+        if self.sleeping:
+            self.sleep_ticks = (self.sleep_ticks + 1) % len(self.cycle)
+            return
+
         super().update(tilemap, movement=(0, 0))
 
         entity_rect = self.rect()
-        for other in self.game.boxes + [self.game.player] + self.game.enemies:
+        self.area.update(entity_rect)
+        self.area.inflate_ip(0, self.size[1] * 2)
+        for other in self.game.entity_hash.query(self.area, None, self.nearby):
             if other is not self and entity_rect.colliderect(other.rect()):
                 if self.velocity[1] > 0:
                     entity_rect.bottom = other.rect().top
-                    self.collisions['down'] = True
+                    self.collisions |= COLLIDE_DOWN
                 elif self.velocity[1] < 0:
                     entity_rect.top = other.rect().bottom
-                    self.collisions['up'] = True
+                    self.collisions |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
         for door in self.game.doors:
             if not door.open and entity_rect.colliderect(door.rect()):
                 if self.velocity[1] > 0:
                     entity_rect.bottom = door.rect().top
-                    self.collisions['down'] = True
+                    self.collisions |= COLLIDE_DOWN
                 elif self.velocity[1] < 0:
                     entity_rect.top = door.rect().bottom
-                    self.collisions['up'] = True
+                    self.collisions |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
-        if self.collisions['down'] or self.collisions['up']:
+        if self.collisions & COLLIDE_VERTICAL:
             self.velocity[1] = 0
 
+        self.moved()
+        self.settle()
+
 
 class Button:
+    __slots__ = ('game', 'color', 'pos', 'size', 'pressed', 'dirty', 'bounds', 'nearby')
+
     def __init__(self, game, pos, size, color='red'):
         self.game = game
         self.color = color
         self.pos = list(pos)
         self.size = size
         self.pressed = False
+        self.dirty = True
+        self.bounds = pygame.Rect(self.pos[0], self.pos[1] + size[1] // 2, size[0], size[1] // 2)
+        self.nearby = []
 
     def rect(self):
-        return pygame.Rect(self.pos[0], self.pos[1] + self.size[1] // 2, self.size[0], self.size[1] // 2)
+        return self.bounds
 
     def update(self):
-        self.pressed = any(
-            self.rect().colliderect(entity.rect())
-            for entity in [self.game.player] + self.game.boxes + self.game.enemies
-        )
+        self.dirty = False
+        button_rect = self.rect()
+        pressed = False
+        for entity in self.game.entity_hash.query(button_rect, None, self.nearby):
+            if button_rect.colliderect(entity.rect()):
+                pressed = True
+                break
+        if pressed != self.pressed:
+            self.pressed = pressed
+            self.game.signals.drive(self.color, pressed)
 
-    def render(self, surf):
+    def render(self, surf, offset=(0, 0)):
         sprite = f'button_{self.color}_pressed' if self.pressed else f'button_{self.color}'
-        surf.blit(self.game.assets[sprite], self.pos)
+        surf.blit(self.game.assets[sprite], (self.pos[0] - offset[0], self.pos[1] - offset[1]))
 
 
 class Door:
+    __slots__ = ('game', 'color', 'pos', 'size', 'open', 'bounds')
+
     def __init__(self, game, pos, size, color='red'):
         self.game = game
         self.color = color
         self.pos = list(pos)
         self.size = size
         self.open = False
+        self.bounds = pygame.Rect(self.pos[0], self.pos[1], size[0], size[1])
+        game.signals.subscribe(color, self.signal)
 
     def rect(self):
-        return pygame.Rect(self.pos[0], self.pos[1], self.size[0], self.size[1])
+        return self.bounds
 
-    def update(self):
-        self.open = any(button.color == self.color and button.pressed for button in self.game.buttons)
+    def signal(self, active):
+        self.open = active
+        self.game.wake_area(self.rect())
 
-    def render(self, surf):
+    def render(self, surf, offset=(0, 0)):
         sprite = f'door_{self.color}_open' if self.open else f'door_{self.color}'
-        surf.blit(self.game.assets[sprite], self.pos)
+        surf.blit(self.game.assets[sprite], (self.pos[0] - offset[0], self.pos[1] - offset[1]))
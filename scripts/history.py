@@ -0,0 +1,91 @@
+MAX_UNDO = 200
+
+
+class Edit:
+    def __init__(self):
+        self.before = {}
+        self.after = {}
+        self.added = []
+        self.removed = []
+
+    def empty(self):
+        return not (self.before or self.added or self.removed)
+
+
+class EditHistory:
+    def __init__(self, tilemap, limit=MAX_UNDO):
+        self.tilemap = tilemap
+        self.limit = limit
+        self.undo_stack = []
+        self.redo_stack = []
+        self.edit = None
+
+    def begin(self):
+        if self.edit is None:
+            self.edit = Edit()
+
+    def end(self):
+        edit = self.edit
+        self.edit = None
+        if edit is None:
+            return
+        for loc in list(edit.before):
+            if edit.before[loc] is edit.after[loc]:
+                del edit.before[loc]
+                del edit.after[loc]
+        if edit.empty():
+            return
+        self.undo_stack.append(edit)
+        if len(self.undo_stack) > self.limit:
+            self.undo_stack.pop(0)
+        self.redo_stack.clear()
+
+    def set_tiles(self, changes):
+        single = self.edit is None
+        self.begin()
+        previous = self.tilemap.apply_tiles(changes)
+        for loc, tile in previous.items():
+            self.edit.before.setdefault(loc, tile)
+            self.edit.after[loc] = changes[loc]
+        if single:
+            self.end()
+
+    def add_offgrid(self, tile):
+        single = self.edit is None
+        self.begin()
+        self.tilemap.add_offgrid(tile)
+        self.edit.added.append(tile)
+        if single:
+            self.end()
+
+    def remove_offgrid(self, tile):
+        single = self.edit is None
+        self.begin()
+        self.tilemap.remove_offgrid(tile)
+        if tile in self.edit.added:
+            self.edit.added.remove(tile)
+        else:
+            self.edit.removed.append(tile)
+        if single:
+            self.end()
+
+    def apply(self, tiles, added, removed):
+        self.tilemap.apply_tiles(tiles)
+        for tile in removed:
+            self.tilemap.remove_offgrid(tile)
+        for tile in added:
+            self.tilemap.add_offgrid(tile)
+
+    def undo(self):
+        self.end()
+        if self.undo_stack:
+            edit = self.undo_stack.pop()
+            self.apply(edit.before, edit.removed, edit.added)
+            self.redo_stack.append(edit)
+
+    def redo(self):
+        self.end()
+        if self.redo_stack:
+            edit = self.redo_stack.pop()
+            self.apply(edit.after, edit.added, edit.removed)
+            self.undo_stack.append(edit)
@@ -0,0 +1,23 @@
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+INPUT_RESTART = 8
+INPUT_QUICK_SAVE = 16
+INPUT_QUICK_LOAD = 32
+
+
+def pack_inputs(movement, jump=False, restart=False, quick_save=False, quick_load=False):
+    inputs = 0
+    if movement[0]:
+        inputs |= INPUT_LEFT
+    if movement[1]:
+        inputs |= INPUT_RIGHT
+    if jump:
+        inputs |= INPUT_JUMP
+    if restart:
+        inputs |= INPUT_RESTART
+    if quick_save:
+        inputs |= INPUT_QUICK_SAVE
+    if quick_load:
+        inputs |= INPUT_QUICK_LOAD
+    return inputs
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+
+SPAWN_TYPES = ('player', 'box', 'enemy')
+SPAWN_PREFIXES = ('button_', 'door_')
+MAGIC = b'DLVL'
+VERSION = 2
+HEADER = struct.Struct('<4sHHHIIII')
+COMPILED_DIR = 'compiled'
+
+
+def is_spawn(tile_type):
+    return tile_type in SPAWN_TYPES or tile_type.startswith(SPAWN_PREFIXES)
+
+
+def compiled_path(path):
+    name = os.path.splitext(os.path.basename(path))[0] + '.lvl'
+    return os.path.join(os.path.dirname(path), COMPILED_DIR, name)
+
+
+def split_level(map_data):
+    tilemap = {}
+    spawns = []
+    for loc in map_data['tilemap']:
+        tile = map_data['tilemap'][loc]
+        if is_spawn(tile['type']):
+            spawns.append((tile['type'], tuple(tile['pos'])))
+        else:
+            tilemap[loc] = tile
+    return {'tilemap': tilemap, 'tile_size': map_data['tile_size'], 'offgrid': map_data['offgrid'],
+            'spawns': spawns, 'wiring': map_data.get('wiring', [])}
+
+
+def pack_level(level_data):
+    types = []
+    type_ids = {}
+
+    def type_id(tile_type):
+        if tile_type not in type_ids:
+            type_ids[tile_type] = len(types)
+            types.append(tile_type)
+        return type_ids[tile_type]
+
+    tiles = level_data['tilemap'].values()
+    tile_x = array('h', [tile['pos'][0] for tile in tiles])
+    tile_y = array('h', [tile['pos'][1] for tile in tiles])
+    tile_t = array('B', [type_id(tile['type']) for tile in tiles])
+    offgrid_x = array('d', [tile['pos'][0] for tile in level_data['offgrid']])
+    offgrid_y = array('d', [tile['pos'][1] for tile in level_data['offgrid']])
+    offgrid_t = array('B', [type_id(tile['type']) for tile in level_data['offgrid']])
+    spawn_x = array('h', [spawn[1][0] for spawn in level_data['spawns']])
+    spawn_y = array('h', [spawn[1][1] for spawn in level_data['spawns']])
+    spawn_t = array('B', [type_id(spawn[0]) for spawn in level_data['spawns']])
+
+    type_table = '\n'.join(types).encode('utf-8')
+    wiring = json.dumps(level_data['wiring'], separators=(',', ':')).encode('utf-8')
+    header = HEADER.pack(MAGIC, VERSION, level_data['tile_size'], len(type_table), len(tile_t), len(offgrid_t),
+                         len(spawn_t), len(wiring))
+    return b''.join([header, type_table, wiring, tile_x.tobytes(), tile_y.tobytes(), tile_t.tobytes(),
+                     offgrid_x.tobytes(), offgrid_y.tobytes(), offgrid_t.tobytes(), spawn_x.tobytes(),
+                     spawn_y.tobytes(), spawn_t.tobytes()])
+
+
+def unpack_level(data):
+    magic, version, tile_size, table_size, n_tiles, n_offgrid, n_spawns, wiring_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a compiled level')
+    size = HEADER.size + table_size + wiring_size + n_tiles * 5 + n_offgrid * 17 + n_spawns * 5
+    if len(data) != size:
+        raise ValueError(f'compiled level is {len(data)} bytes, header says {size}')
+    offset = HEADER.size
+    types = data[offset:offset + table_size].decode('utf-8').split('\n')
+    offset += table_size
+    wiring = json.loads(data[offset:offset + wiring_size].decode('utf-8'))
+    offset += wiring_size
+
+    def read(typecode, count):
+        nonlocal offset
+        values = array(typecode)
+        values.frombytes(data[offset:offset + count * values.itemsize])
+        offset += count * values.itemsize
+        return values
+
+    tile_x, tile_y, tile_t = read('h', n_tiles), read('h', n_tiles), read('B', n_tiles)
+    offgrid_x, offgrid_y, offgrid_t = read('d', n_offgrid), read('d', n_offgrid), read('B', n_offgrid)
+    spawn_x, spawn_y, spawn_t = read('h', n_spawns), read('h', n_spawns), read('B', n_spawns)
+
+    tilemap = {f'{x};{y}': {'type': types[t], 'pos': [x, y]} for x, y, t in zip(tile_x, tile_y, tile_t)}
+    offgrid = [{'type': types[t], 'pos': [x, y]} for x, y, t in zip(offgrid_x, offgrid_y, offgrid_t)]
+    spawns = [(types[t], (x, y)) for x, y, t in zip(spawn_x, spawn_y, spawn_t)]
+    return {'tilemap': tilemap, 'tile_size': tile_size, 'offgrid': offgrid, 'spawns': spawns, 'wiring': wiring}
+
+
+def compile_level(path):
+    f = open(path, 'r')
+    level_data = split_level(json.load(f))
+    f.close()
+
+    target = compiled_path(path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = target + '.' + str(os.getpid()) + '.tmp'
+    f = open(temp, 'wb')
+    f.write(pack_level(level_data))
+    f.close()
+    os.replace(temp, target)
+    return level_data
+
+
+def load_level_data(path):
+    compiled = compiled_path(path)
+    if os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(path):
+        f = open(compiled, 'rb')
+        data = f.read()
+        f.close()
+        try:
+            return unpack_level(data)
+        except (ValueError, IndexError, struct.error):
+            pass
+
+    try:
+        return compile_level(path)
+    except OSError:
+        f = open(path, 'r')
+        level_data = split_level(json.load(f))
+        f.close()
+        return level_data
+
+
+class LevelCache:
+    def __init__(self, maps_dir='data/maps', capacity=4):
+        self.maps_dir = maps_dir
+        self.capacity = capacity
+        self.levels = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def path(self, map_id):
+        return os.path.join(self.maps_dir, str(map_id) + '.json')
+
+    def store(self, map_id, level_data):
+        with self.lock:
+            self.levels[map_id] = level_data
+            self.levels.move_to_end(map_id)
+            while len(self.levels) > self.capacity:
+                self.levels.popitem(last=False)
+            self.pending.pop(map_id, None)
+
+    def fetch(self, map_id):
+        try:
+            self.store(map_id, load_level_data(self.path(map_id)))
+        except (OSError, ValueError):
+            with self.lock:
+                self.pending.pop(map_id, None)
+
+    def prefetch(self, map_id):
+        with self.lock:
+            if map_id in self.levels or not os.path.exists(self.path(map_id)):
+                return None
+            if map_id in self.pending:
+                return self.pending[map_id]
+            thread = threading.Thread(target=self.fetch, args=(map_id,), daemon=True)
+            self.pending[map_id] = thread
+        thread.start()
+        return thread
+
+    def get(self, map_id):
+        with self.lock:
+            thread = self.pending.get(map_id)
+        if thread:
+            thread.join()
+
+        with self.lock:
+            level_data = self.levels.get(map_id)
+            if level_data:
+                self.levels.move_to_end(map_id)
+        if not level_data:
+            level_data = load_level_data(self.path(map_id))
+            self.store(map_id, level_data)
+
+        return {'tilemap': dict(level_data['tilemap']), 'tile_size': level_data['tile_size'],
+                'offgrid': list(level_data['offgrid']), 'spawns': level_data['spawns'], 'wiring': level_data['wiring']}
+
+
+if __name__ == '__main__':
+    for map_path in sys.argv[1:] or sorted(name for name in os.listdir('data/maps') if name.endswith('.json')):
+        if not os.path.dirname(map_path):
+            map_path = os.path.join('data/maps', map_path)
+        compile_level(map_path)
+        print(map_path, '->', compiled_path(map_path))
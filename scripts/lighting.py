@@ -0,0 +1,93 @@
+import pygame
+
+
+LIGHT_TILES = {'torch'}
+LIGHT_RADIUS = 48
+LIGHT_COLOR = (110, 70, 30)
+LIGHT_STEPS = 16
+LIGHT_OFFSET_Y = 8
+
+falloff_cache = {}
+
+
+def falloff(radius=LIGHT_RADIUS, color=LIGHT_COLOR, steps=LIGHT_STEPS):
+    key = (radius, color, steps)
+    surf = falloff_cache.get(key)
+    if surf is None:
+        surf = pygame.Surface((radius * 2, radius * 2))
+        surf.fill((0, 0, 0))
+        for i in range(steps):
+            strength = ((i + 1) / steps) ** 2
+            pygame.draw.circle(surf, [int(channel * strength) for channel in color], (radius, radius),
+                               radius * (steps - i) / steps)
+        falloff_cache[key] = surf
+    return surf
+
+
+class LightMap:
+    def __init__(self, radius=LIGHT_RADIUS):
+        self.radius = radius
+        self.lights = {}
+        self.surface = None
+        self.bounds = pygame.Rect(0, 0, 0, 0)
+        self.dirty = []
+        self.stale = True
+
+    def clear(self):
+        self.lights = {}
+        self.stale = True
+
+    def glow_rect(self, center):
+        return pygame.Rect(center[0] - self.radius, center[1] - self.radius, self.radius * 2, self.radius * 2)
+
+    def add(self, key, center):
+        self.lights[key] = center
+        self.changed(center)
+
+    def remove(self, key):
+        center = self.lights.pop(key, None)
+        if center is not None:
+            self.changed(center)
+
+    def changed(self, center):
+        if self.stale:
+            return
+        area = self.glow_rect(center)
+        if self.bounds.contains(area):
+            self.dirty.append(area)
+        else:
+            self.stale = True
+
+    def bake(self):
+        self.stale = False
+        self.dirty = []
+        if not self.lights:
+            self.surface = None
+            self.bounds = pygame.Rect(0, 0, 0, 0)
+            return
+        self.bounds = self.glow_rect(next(iter(self.lights.values()))).unionall(
+            [self.glow_rect(center) for center in self.lights.values()])
+        self.surface = pygame.Surface(self.bounds.size)
+        self.redraw(self.bounds)
+
+    def redraw(self, area):
+        glow = falloff(self.radius)
+        self.surface.set_clip(area.move(-self.bounds.x, -self.bounds.y))
+        self.surface.fill((0, 0, 0))
+        for center in self.lights.values():
+            rect = self.glow_rect(center)
+            if rect.colliderect(area):
+                self.surface.blit(glow, (rect.x - self.bounds.x, rect.y - self.bounds.y),
+                                  special_flags=pygame.BLEND_RGB_ADD)
+        self.surface.set_clip(None)
+
+    def render(self, surf, offset=(0, 0)):
+        if self.stale:
+            self.bake()
+        elif self.dirty:
+            for area in self.dirty:
+                self.redraw(area)
+            self.dirty = []
+        if self.surface:
+            surf.blit(self.surface, (self.bounds.x - offset[0], self.bounds.y - offset[1]),
+                      special_flags=pygame.BLEND_RGB_ADD)
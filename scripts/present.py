@@ -0,0 +1,80 @@
+import queue
+import threading
+import pygame
+
+
+class TextCache:
+    def __init__(self, size, color):
+        self.font = pygame.font.SysFont(None, size)
+        self.color = color
+        self.text = None
+        self.surf = None
+
+    def render(self, text):
+        if text != self.text:
+            self.text = text
+            self.surf = self.font.render(text, True, self.color)
+        return self.surf
+
+
+class Presenter:
+    def __init__(self, screen, display):
+        self.screen = screen
+        self.display = display
+        self.scale = (screen.get_width() // display.get_width(), screen.get_height() // display.get_height())
+
+    def screen_rect(self, rect):
+        return pygame.Rect(rect.x * self.scale[0], rect.y * self.scale[1], rect.w * self.scale[0],
+                           rect.h * self.scale[1])
+
+    def compose(self, display, overlays=()):
+        pygame.transform.scale(display, self.screen.get_size(), self.screen)
+        for surf, pos in overlays:
+            self.screen.blit(surf, pos)
+
+    def present(self, overlays=(), dirty_rects=None):
+        if dirty_rects is None:
+            self.compose(self.display, overlays)
+            pygame.display.update()
+            return
+
+        display_rect = self.display.get_rect()
+        updated = []
+        for rect in dirty_rects:
+            rect = rect.clip(display_rect)
+            if not rect.w or not rect.h:
+                continue
+            target = self.screen_rect(rect)
+            pygame.transform.scale(self.display.subsurface(rect), target.size, self.screen.subsurface(target))
+            updated.append(target)
+        for surf, pos in overlays:
+            updated.append(self.screen.blit(surf, pos))
+        pygame.display.update(updated)
+
+
+class PresentWorker:
+    def __init__(self, presenter):
+        self.presenter = presenter
+        self.jobs = queue.Queue(maxsize=1)
+        self.done = threading.Event()
+        self.pending = False
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            display, overlays = self.jobs.get()
+            self.presenter.compose(display, overlays)
+            self.done.set()
+
+    def submit(self, display, overlays=()):
+        self.flip()
+        self.done.clear()
+        self.pending = True
+        self.jobs.put((display, list(overlays)))
+
+    def flip(self):
+        if self.pending:
+            self.done.wait()
+            self.pending = False
+            pygame.display.update()
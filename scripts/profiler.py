@@ -0,0 +1,161 @@
+import os
+import csv
+import time
+import multiprocessing
+import pygame
+from collections import deque
+
+
+PROFILE_ENV = 'DIPLOMA_PROFILE'
+OVERLAY_INTERVAL = 30
+
+wrapped = {}
+csv_paths = set()
+
+
+def unique_csv_path(path):
+    if path not in csv_paths and multiprocessing.parent_process() is None:
+        csv_paths.add(path)
+        return path
+    root, ext = os.path.splitext(path)
+    n = 1
+    while f'{root}-{os.getpid()}-{n}{ext}' in csv_paths:
+        n += 1
+    path = f'{root}-{os.getpid()}-{n}{ext}'
+    csv_paths.add(path)
+    return path
+
+
+class FrameProfiler:
+    def __init__(self, phases, counters=(), window=240):
+        self.phases = phases
+        self.counters = counters
+        self.history = {phase: deque(maxlen=window) for phase in phases}
+        self.times = dict.fromkeys(phases, 0.0)
+        self.counts = dict.fromkeys(counters, 0)
+        self.last_counts = dict(self.counts)
+        self.hooks = []
+        self.frame = 0
+        self.last = 0
+        self.enabled = False
+        self.csv_file = None
+        self.csv_writer = None
+        self.font = None
+        self.overlay = None
+        self.csv_path = None
+        self.requested_path = 'profile.csv'
+
+        path = os.environ.get(PROFILE_ENV)
+        if path:
+            if path.endswith('.csv'):
+                self.requested_path = path
+            self.enable()
+
+    def count_calls(self, owner, name, counter):
+        self.hooks.append((owner, name, counter))
+        if self.enabled:
+            self.wrap(owner, name, counter)
+
+    def wrap(self, owner, name, counter):
+        key = (owner, name)
+        wrapped[key] = wrapped.get(key, 0) + 1
+        if wrapped[key] > 1:
+            return
+        original = getattr(owner, name)
+
+        def counted(obj, *args, **kwargs):
+            profiler = obj.game.profiler
+            if profiler.enabled and counter in profiler.counts:
+                profiler.counts[counter] += 1
+            return original(obj, *args, **kwargs)
+
+        counted.original = original
+        setattr(owner, name, counted)
+
+    def unwrap(self, owner, name):
+        key = (owner, name)
+        wrapped[key] -= 1
+        if not wrapped[key]:
+            del wrapped[key]
+            setattr(owner, name, getattr(owner, name).original)
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        if self.csv_path is None:
+            self.csv_path = unique_csv_path(self.requested_path)
+        self.csv_file = open(self.csv_path, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(('frame',) + tuple(f'{phase}_ms' for phase in self.phases) + self.counters)
+        for owner, name, counter in self.hooks:
+            self.wrap(owner, name, counter)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.csv_file.close()
+        self.csv_file = None
+        self.csv_writer = None
+        self.overlay = None
+        for owner, name, _ in self.hooks:
+            self.unwrap(owner, name)
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def begin_frame(self):
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def mark(self, phase):
+        if self.enabled:
+            now = time.perf_counter()
+            self.times[phase] += now - self.last
+            self.last = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.frame += 1
+        row = [self.frame]
+        for phase in self.phases:
+            ms = self.times[phase] * 1000
+            self.history[phase].append(ms)
+            row.append(f'{ms:.3f}')
+            self.times[phase] = 0.0
+        for counter in self.counters:
+            row.append(self.counts[counter])
+            self.last_counts[counter] = self.counts[counter]
+            self.counts[counter] = 0
+        self.csv_writer.writerow(row)
+        if self.frame % OVERLAY_INTERVAL == 0:
+            self.overlay = None
+
+    def percentiles(self, phase):
+        values = sorted(self.history[phase])
+        if not values:
+            return 0, 0, 0
+        return tuple(values[min(len(values) - 1, int(len(values) * p))] for p in (0.5, 0.95, 0.99))
+
+    def render_overlay(self):
+        if not self.enabled:
+            return None
+        if self.overlay is None:
+            if self.font is None:
+                self.font = pygame.font.SysFont('monospace', 14)
+            lines = ['phase        p50    p95    p99 ms']
+            for phase in self.phases:
+                lines.append(f'{phase:<10} ' + ' '.join(f'{value:6.2f}' for value in self.percentiles(phase)))
+            for counter in self.counters:
+                lines.append(f'{counter:<20} {self.last_counts[counter]:6d}')
+            line_height = self.font.get_linesize()
+            self.overlay = pygame.Surface((280, line_height * len(lines) + 8))
+            self.overlay.set_alpha(200)
+            for i, line in enumerate(lines):
+                self.overlay.blit(self.font.render(line, True, (255, 255, 255)), (4, 4 + i * line_height))
+        return self.overlay
@@ -0,0 +1,69 @@
+import struct
+import hashlib
+from array import array
+
+
+MAGIC = b'DRPL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIB20s')
+
+
+def state_hash(game):
+    state = game.snapshot()
+    state.append(game.deaths)
+    return hashlib.sha1(state.tobytes()).digest()
+
+
+class InputLog:
+    def __init__(self, level=0, inputs=None, expected=None):
+        self.level = level
+        self.inputs = array('B') if inputs is None else inputs
+        self.expected = expected
+
+    def record(self, inputs):
+        self.inputs.append(inputs)
+
+    def check(self, game):
+        if self.expected is None:
+            return None
+        return state_hash(game) == self.expected
+
+    def save(self, path, game=None):
+        values = array('B')
+        counts = array('I')
+        for inputs in self.inputs:
+            if values and values[-1] == inputs:
+                counts[-1] += 1
+            else:
+                values.append(inputs)
+                counts.append(1)
+
+        expected = state_hash(game) if game else self.expected
+        header = HEADER.pack(MAGIC, VERSION, self.level, len(self.inputs), len(values), expected is not None,
+                             expected or bytes(20))
+        f = open(path, 'wb')
+        f.write(b''.join([header, values.tobytes(), counts.tobytes()]))
+        f.close()
+
+
+def load_log(path):
+    f = open(path, 'rb')
+    data = f.read()
+    f.close()
+
+    magic, version, level, ticks, n_runs, has_hash, expected = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not an input log: ' + path)
+    values = array('B')
+    counts = array('I')
+    offset = HEADER.size
+    values.frombytes(data[offset:offset + n_runs * values.itemsize])
+    offset += n_runs * values.itemsize
+    counts.frombytes(data[offset:offset + n_runs * counts.itemsize])
+
+    inputs = array('B')
+    for value, count in zip(values, counts):
+        inputs.frombytes(bytes((value,)) * count)
+    if len(inputs) != ticks:
+        raise ValueError('truncated input log: ' + path)
+    return InputLog(level, inputs, expected if has_hash else None)
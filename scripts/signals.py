@@ -0,0 +1,91 @@
+GATE_TYPES = ('and', 'or', 'timer')
+CHANNEL_COLORS = {
+    'yellow': (255, 220, 60),
+    'purple': (170, 90, 230),
+    'orange': (255, 150, 40),
+    'cyan': (70, 220, 240),
+    'pink': (255, 120, 190),
+    'white': (255, 255, 255),
+}
+
+
+class Gate:
+    def __init__(self, bus, kind, inputs, output, ticks=0):
+        if kind not in GATE_TYPES:
+            raise ValueError('unknown gate type: ' + str(kind))
+        self.bus = bus
+        self.kind = kind
+        self.inputs = list(inputs)
+        self.output = output
+        self.ticks = ticks
+        self.active = False
+        self.remaining = 0
+
+    def signal(self, active=False):
+        if self.kind == 'and':
+            self.set(all(self.bus.is_on(channel) for channel in self.inputs))
+        elif any(self.bus.is_on(channel) for channel in self.inputs):
+            self.remaining = 0
+            self.set(True)
+        elif self.kind == 'or' or self.ticks <= 0:
+            self.set(False)
+        elif self.active and not self.remaining:
+            self.remaining = self.ticks
+
+    def set(self, active):
+        if active != self.active:
+            self.active = active
+            self.bus.drive(self.output, active)
+
+    def tick(self):
+        self.remaining -= 1
+        if not self.remaining:
+            self.set(False)
+
+
+class SignalBus:
+    def __init__(self, wiring=()):
+        self.counts = {}
+        self.listeners = {}
+        self.gates = []
+        for spec in wiring:
+            gate = Gate(self, spec['type'], spec['inputs'], spec['output'], spec.get('ticks', 0))
+            self.gates.append(gate)
+            for channel in gate.inputs:
+                self.subscribe(channel, gate.signal)
+        self.timers = [gate for gate in self.gates if gate.kind == 'timer']
+
+    def subscribe(self, channel, callback):
+        self.listeners.setdefault(channel, []).append(callback)
+
+    def is_on(self, channel):
+        return self.counts.get(channel, 0) > 0
+
+    def drive(self, channel, active):
+        count = self.counts.get(channel, 0) + (1 if active else -1)
+        self.counts[channel] = count
+        if count == (1 if active else 0):
+            for callback in self.listeners.get(channel, ()):
+                callback(active)
+
+    def tick(self):
+        for gate in self.timers:
+            if gate.remaining:
+                gate.tick()
+
+    def state(self):
+        values = []
+        for gate in self.gates:
+            values.extend((gate.active, gate.remaining))
+        return values
+
+    def restore(self, values, buttons):
+        self.counts.clear()
+        for i, gate in enumerate(self.gates):
+            gate.active = bool(values[i * 2])
+            gate.remaining = int(values[i * 2 + 1])
+            if gate.active:
+                self.counts[gate.output] = self.counts.get(gate.output, 0) + 1
+        for button in buttons:
+            if button.pressed:
+                self.counts[button.color] = self.counts.get(button.color, 0) + 1
@@ -0,0 +1,54 @@
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entity_cells = {}
+        self.order = {}
+        self.order_key = self.order.__getitem__
+
+    def clear(self):
+        self.cells = {}
+        self.entity_cells = {}
+        self.order = {}
+        self.order_key = self.order.__getitem__
+
+    def cell(self, pos):
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+    def insert(self, entity):
+        cell = self.cell(entity.pos)
+        self.cells.setdefault(cell, []).append(entity)
+        self.entity_cells[entity] = cell
+        self.order[entity] = len(self.order)
+
+    def move(self, entity):
+        old_cell = self.entity_cells.get(entity)
+        if old_cell is None:
+            return
+        cell = self.cell(entity.pos)
+        if cell != old_cell:
+            self.cells[old_cell].remove(entity)
+            bucket = self.cells.get(cell)
+            if bucket is None:
+                self.cells[cell] = [entity]
+            else:
+                bucket.append(entity)
+            self.entity_cells[entity] = cell
+
+    def query(self, rect, types=None, out=None):
+        found = [] if out is None else out
+        found.clear()
+        x0 = (rect.left - self.cell_size - 1) // self.cell_size
+        y0 = (rect.top - self.cell_size - 1) // self.cell_size
+        x1 = rect.right // self.cell_size
+        y1 = rect.bottom // self.cell_size
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                bucket = self.cells.get((x, y))
+                if bucket:
+                    for entity in bucket:
+                        if types is None or entity.type in types:
+                            found.append(entity)
+        if len(found) > 1:
+            found.sort(key=self.order_key)
+        return found
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+
+from scripts.levels import split_level
+from scripts.tilemap import CHUNK_SIZE
+
+
+WORLD_FILE = 'world.json'
+SIM_RADIUS = 1
+LOAD_RADIUS = 2
+MAX_RESIDENT = 36
+
+
+def chunk_file(world_dir, chunk):
+    return os.path.join(world_dir, 'chunks', f'{chunk[0]}_{chunk[1]}.json')
+
+
+def split_map(path, world_dir, chunk_size=CHUNK_SIZE):
+    f = open(path, 'r')
+    level_data = split_level(json.load(f))
+    f.close()
+
+    tile_size = level_data['tile_size']
+    chunks = {}
+    for loc, tile in level_data['tilemap'].items():
+        chunk = (tile['pos'][0] // chunk_size, tile['pos'][1] // chunk_size)
+        chunks.setdefault(chunk, {'tilemap': {}, 'offgrid': []})['tilemap'][loc] = tile
+    for tile in level_data['offgrid']:
+        chunk = (int(tile['pos'][0] // (tile_size * chunk_size)), int(tile['pos'][1] // (tile_size * chunk_size)))
+        chunks.setdefault(chunk, {'tilemap': {}, 'offgrid': []})['offgrid'].append(tile)
+
+    xs = [tile['pos'][0] for tile in level_data['tilemap'].values()] + [pos[0] for _, pos in level_data['spawns']]
+    ys = [tile['pos'][1] for tile in level_data['tilemap'].values()] + [pos[1] for _, pos in level_data['spawns']]
+    bounds = [min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1]
+
+    os.makedirs(os.path.join(world_dir, 'chunks'), exist_ok=True)
+    for chunk, chunk_data in chunks.items():
+        f = open(chunk_file(world_dir, chunk), 'w')
+        json.dump(chunk_data, f)
+        f.close()
+
+    f = open(os.path.join(world_dir, WORLD_FILE), 'w')
+    json.dump({'tile_size': tile_size, 'chunk_size': chunk_size, 'bounds': bounds,
+               'chunks': sorted(chunks), 'spawns': level_data['spawns'], 'wiring': level_data['wiring']}, f)
+    f.close()
+
+
+def read_chunk(world_dir, chunk):
+    f = open(chunk_file(world_dir, chunk), 'r')
+    chunk_data = json.load(f)
+    f.close()
+    return chunk_data
+
+
+class ChunkStreamer:
+    def __init__(self, tilemap, world_dir, sim_radius=SIM_RADIUS, load_radius=LOAD_RADIUS, max_resident=MAX_RESIDENT):
+        self.tilemap = tilemap
+        self.world_dir = world_dir
+        self.sim_radius = sim_radius
+        self.load_radius = max(load_radius, sim_radius)
+        self.max_resident = max(max_resident, (self.load_radius * 2 + 2) ** 2)
+        self.active = (0, 0, -1, -1)
+        self.resident = OrderedDict()
+        self.requested = set()
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+
+        f = open(os.path.join(world_dir, WORLD_FILE), 'r')
+        world = json.load(f)
+        f.close()
+        self.chunk_size = world['chunk_size']
+        self.chunks = set(tuple(chunk) for chunk in world['chunks'])
+        self.level_data = {'tilemap': {}, 'tile_size': world['tile_size'], 'offgrid': [], 'bounds': world['bounds'],
+                           'spawns': [(tile_type, tuple(pos)) for tile_type, pos in world['spawns']],
+                           'wiring': world.get('wiring', [])}
+
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def worker(self):
+        while True:
+            chunk = self.requests.get()
+            if chunk is None:
+                return
+            try:
+                self.results.put((chunk, read_chunk(self.world_dir, chunk)))
+            except (OSError, ValueError):
+                self.results.put((chunk, None))
+
+    def stop(self):
+        self.requests.put(None)
+
+    def chunk_at(self, pos):
+        span = self.tilemap.tile_size * self.chunk_size
+        return int(pos[0] // span), int(pos[1] // span)
+
+    def chunk_window(self, pos, radius):
+        span = self.tilemap.tile_size * self.chunk_size
+        margin = self.tilemap.tile_size * 2
+        x0, y0 = int((pos[0] - margin) // span), int((pos[1] - margin) // span)
+        x1, y1 = int((pos[0] + margin) // span), int((pos[1] + margin) // span)
+        return x0 - radius, y0 - radius, x1 + radius, y1 + radius
+
+    def chunks_near(self, pos, radius):
+        x0, y0, x1, y1 = self.chunk_window(pos, radius)
+        return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1) if (x, y) in self.chunks]
+
+    def is_active(self, pos):
+        x0, y0, x1, y1 = self.chunk_window(pos, 0)
+        ax0, ay0, ax1, ay1 = self.active
+        return ax0 <= x0 and ay0 <= y0 and x1 <= ax1 and y1 <= ay1
+
+    def attach(self, chunk, chunk_data):
+        self.requested.discard(chunk)
+        if chunk in self.resident or chunk_data is None:
+            return
+        tilemap = self.tilemap
+        for loc, tile in chunk_data['tilemap'].items():
+            tilemap.tilemap[loc] = tile
+            tilemap.index_tile(tile, merge=False)
+            tilemap.add_to_chunks(tile)
+        for tile in chunk_data['offgrid']:
+            tilemap.add_offgrid(tile)
+        self.merge(chunk)
+        self.resident[chunk] = chunk_data
+
+    def detach(self, chunk):
+        chunk_data = self.resident.pop(chunk)
+        tilemap = self.tilemap
+        for loc in chunk_data['tilemap']:
+            tile = tilemap.tilemap.pop(loc)
+            tilemap.unindex_tile(tile, merge=False)
+            tilemap.remove_from_chunks(tile)
+        for tile in chunk_data['offgrid']:
+            tilemap.remove_offgrid(tile)
+        self.merge(chunk)
+
+    def merge(self, chunk):
+        x = chunk[0] * self.chunk_size
+        y = chunk[1] * self.chunk_size
+        self.tilemap.merge_area(x, y, x + self.chunk_size, y + self.chunk_size)
+
+    def update(self, pos):
+        while not self.results.empty():
+            self.attach(*self.results.get())
+
+        self.active = self.chunk_window(pos, self.sim_radius)
+        needed = self.chunks_near(pos, self.sim_radius)
+        for chunk in needed:
+            if chunk not in self.resident:
+                self.attach(chunk, read_chunk(self.world_dir, chunk))
+
+        wanted = self.chunks_near(pos, self.load_radius)
+        for chunk in wanted:
+            if chunk in self.resident:
+                self.resident.move_to_end(chunk)
+            elif chunk not in self.requested:
+                self.requested.add(chunk)
+                self.requests.put(chunk)
+
+        keep = set(wanted)
+        for chunk in list(self.resident):
+            if len(self.resident) <= self.max_resident:
+                break
+            if chunk not in keep:
+                self.detach(chunk)
+
+
+if __name__ == '__main__':
+    split_map(sys.argv[1], sys.argv[2])
@@ -1,8 +1,17 @@
+import os
 import pygame
 import json
+import threading
+from array import array
+from collections import OrderedDict
+
+from scripts.lighting import LightMap, LIGHT_TILES, LIGHT_OFFSET_Y
 
 
 NEIGHBOR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+PHYSICS_TILES = {'stone'}
+CHUNK_SIZE = 16
+MAX_CACHED_CHUNKS = 64
 
 
 class Tilemap:
@@ -11,44 +20,378 @@ class Tilemap:
         self.tile_size = tile_size
         self.tilemap = {}
         self.offgrid_tiles = []
+        self.wiring = []
+        self.chunk_tiles = None
+        self.chunk_surfaces = OrderedDict()
+        self.dirty_chunks = set()
+        self.tile_types = [None]
+        self.type_ids = {None: 0}
+        self.grid_origin = (0, 0)
+        self.grid_width = 0
+        self.grid_height = 0
+        self.grid = array('B')
+        self.grid_tiles = []
+        self.solid = bytearray()
+        self.row_rects = []
+        self.column_rects = []
+        self.listeners = []
+        self.light = LightMap()
+
+    def save(self, path, background=False, done=None):
+        map_data = {'tilemap': dict(self.tilemap), 'tile_size': self.tile_size, 'offgrid': list(self.offgrid_tiles)}
+        if self.wiring:
+            map_data['wiring'] = list(self.wiring)
+        if not background:
+            self.write_map(path, map_data, done)
+            return None
+        thread = threading.Thread(target=self.write_map, args=(path, map_data, done))
+        thread.start()
+        return thread
 
-    def save(self, path):
-        f = open(path, 'w')
-        json.dump({'tilemap': self.tilemap, 'tile_size': self.tile_size, 'offgrid': self.offgrid_tiles}, f)
+    def write_map(self, path, map_data, done=None):
+        f = open(path + '.tmp', 'w')
+        json.dump(map_data, f)
         f.close()
+        os.replace(path + '.tmp', path)
+        if done:
+            done(path)
 
     def load(self, path):
         f = open(path, 'r')
         map_data = json.load(f)
         f.close()
 
+        self.load_data(map_data)
+
+    def load_data(self, map_data):
         self.tilemap = map_data['tilemap']
         self.tile_size = map_data['tile_size']
         self.offgrid_tiles = map_data['offgrid']
+        self.wiring = map_data.get('wiring', [])
+        self.build_grid(bounds=map_data.get('bounds'))
+        self.invalidate()
+
+    def type_id(self, tile_type):
+        if tile_type not in self.type_ids:
+            self.type_ids[tile_type] = len(self.tile_types)
+            self.tile_types.append(tile_type)
+        return self.type_ids[tile_type]
+
+    def build_grid(self, margin=0, bounds=None):
+        if bounds:
+            self.grid_origin = (bounds[0], bounds[1])
+            self.grid_width = bounds[2]
+            self.grid_height = bounds[3]
+        elif self.tilemap:
+            xs = [tile['pos'][0] for tile in self.tilemap.values()]
+            ys = [tile['pos'][1] for tile in self.tilemap.values()]
+            self.grid_origin = (min(xs) - margin, min(ys) - margin)
+            self.grid_width = max(xs) - min(xs) + 1 + margin * 2
+            self.grid_height = max(ys) - min(ys) + 1 + margin * 2
+        else:
+            self.grid_origin = (0, 0)
+            self.grid_width = 0
+            self.grid_height = 0
+
+        cells = self.grid_width * self.grid_height
+        self.grid = array('B', bytes(cells))
+        self.grid_tiles = [None] * cells
+        self.solid = bytearray(cells)
+        self.row_rects = [None] * cells
+        self.column_rects = [None] * cells
+        for tile in self.tilemap.values():
+            self.index_tile(tile, merge=False)
+        self.merge_cells(0, 0, self.grid_width, self.grid_height)
+
+    def grid_index(self, tile_pos):
+        x = tile_pos[0] - self.grid_origin[0]
+        y = tile_pos[1] - self.grid_origin[1]
+        if 0 <= x < self.grid_width and 0 <= y < self.grid_height:
+            return y * self.grid_width + x
+        return -1
+
+    def index_tile(self, tile, merge=True):
+        i = self.grid_index(tile['pos'])
+        self.grid[i] = self.type_id(tile['type'])
+        self.grid_tiles[i] = tile
+        solid = tile['type'] in PHYSICS_TILES
+        if solid != self.solid[i]:
+            self.solid[i] = solid
+            if merge:
+                self.merge_cells(i % self.grid_width, i // self.grid_width, i % self.grid_width + 1,
+                                 i // self.grid_width + 1)
+
+    def unindex_tile(self, tile, merge=True):
+        i = self.grid_index(tile['pos'])
+        if i != -1 and self.grid_tiles[i] is tile:
+            self.grid[i] = 0
+            self.grid_tiles[i] = None
+            if self.solid[i]:
+                self.solid[i] = 0
+                if merge:
+                    self.merge_cells(i % self.grid_width, i // self.grid_width, i % self.grid_width + 1,
+                                     i // self.grid_width + 1)
+
+    def merge_area(self, tile_x0, tile_y0, tile_x1, tile_y1):
+        self.merge_cells(tile_x0 - self.grid_origin[0], tile_y0 - self.grid_origin[1],
+                         tile_x1 - self.grid_origin[0], tile_y1 - self.grid_origin[1])
+
+    def merge_cells(self, x0, y0, x1, y1):
+        width = self.grid_width
+        height = self.grid_height
+        solid = self.solid
+        for y in range(max(0, y0), min(height, y1)):
+            start = max(0, x0)
+            while start > 0 and solid[y * width + start - 1]:
+                start -= 1
+            end = min(width, x1)
+            while end < width and solid[y * width + end]:
+                end += 1
+            self.merge_runs(self.row_rects, y * width + start, 1, end - start)
+        for x in range(max(0, x0), min(width, x1)):
+            start = max(0, y0)
+            while start > 0 and solid[(start - 1) * width + x]:
+                start -= 1
+            end = min(height, y1)
+            while end < height and solid[end * width + x]:
+                end += 1
+            self.merge_runs(self.column_rects, start * width + x, width, end - start)
+        if self.listeners:
+            area = pygame.Rect((self.grid_origin[0] + x0) * self.tile_size, (self.grid_origin[1] + y0) * self.tile_size,
+                               (x1 - x0) * self.tile_size, (y1 - y0) * self.tile_size)
+            for listener in self.listeners:
+                listener(area)
+
+    def merge_runs(self, rects, first, step, count):
+        solid = self.solid
+        run_start = None
+        for n in range(count + 1):
+            if n < count and solid[first + n * step]:
+                if run_start is None:
+                    run_start = n
+                continue
+            if n < count:
+                rects[first + n * step] = None
+            if run_start is None:
+                continue
+
+            start = first + run_start * step
+            x = start % self.grid_width + self.grid_origin[0]
+            y = start // self.grid_width + self.grid_origin[1]
+            length = (n - run_start) * self.tile_size
+            if step == 1:
+                rect = pygame.Rect(x * self.tile_size, y * self.tile_size, length, self.tile_size)
+            else:
+                rect = pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, length)
+            for m in range(run_start, n):
+                rects[first + m * step] = rect
+            run_start = None
+
+    def tile_rect(self, tile, offgrid=False):
+        img = self.game.assets[tile['type']]
+        if offgrid:
+            return pygame.Rect(tile['pos'][0], tile['pos'][1], img.get_width(), img.get_height())
+        return pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, img.get_width(),
+                           img.get_height())
+
+    def pixel_bounds(self):
+        return pygame.Rect(self.grid_origin[0] * self.tile_size, self.grid_origin[1] * self.tile_size,
+                           self.grid_width * self.tile_size, self.grid_height * self.tile_size)
+
+    def set_tile(self, tile_pos, tile_type):
+        loc = str(tile_pos[0]) + ';' + str(tile_pos[1])
+        old = self.tilemap.get(loc)
+        if old and old['type'] == tile_type:
+            return
+        slots = self.remove_from_chunks(old) if old else {}
+        tile = {'type': tile_type, 'pos': tile_pos}
+        self.tilemap[loc] = tile
+        if self.grid_index(tile_pos) == -1:
+            self.build_grid(margin=8)
+        else:
+            self.index_tile(tile)
+        self.add_to_chunks(tile, slots=slots)
+
+    def remove_tile(self, loc):
+        tile = self.tilemap.pop(loc)
+        self.unindex_tile(tile)
+        self.remove_from_chunks(tile)
+        return tile
 
-    def tiles_around(self, pos):
-        tiles = []
-        tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+    def apply_tiles(self, changes):
+        previous = {}
+        xs = []
+        ys = []
+        grow = False
+        for loc, tile in changes.items():
+            old = self.tilemap.get(loc)
+            if old is tile or (old and tile and old['type'] == tile['type']):
+                continue
+            previous[loc] = old
+            slots = {}
+            if old:
+                self.unindex_tile(old, merge=False)
+                slots = self.remove_from_chunks(old)
+                pos = old['pos']
+            if tile:
+                self.tilemap[loc] = tile
+                pos = tile['pos']
+                if self.grid_index(pos) == -1:
+                    grow = True
+                else:
+                    self.index_tile(tile, merge=False)
+                self.add_to_chunks(tile, slots=slots)
+            else:
+                del self.tilemap[loc]
+            xs.append(pos[0])
+            ys.append(pos[1])
+
+        if grow:
+            self.build_grid(margin=8)
+        elif previous:
+            self.merge_area(min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+        return previous
+
+    def offgrid_at(self, pos):
+        if self.chunk_tiles is None:
+            self.index_chunks()
+        size = self.tile_size * CHUNK_SIZE
+        tiles = self.chunk_tiles.get((int(pos[0] // size), int(pos[1] // size)))
+        found = []
+        if tiles:
+            for tile in tiles[0]:
+                img = self.game.assets[tile['type']]
+                x = int(pos[0]) - int(tile['pos'][0])
+                y = int(pos[1]) - int(tile['pos'][1])
+                if 0 <= x < img.get_width() and 0 <= y < img.get_height():
+                    found.append(tile)
+        return found
+
+    def add_offgrid(self, tile):
+        self.offgrid_tiles.append(tile)
+        self.add_to_chunks(tile, offgrid=True)
+
+    def remove_offgrid(self, tile):
+        self.offgrid_tiles.remove(tile)
+        self.remove_from_chunks(tile, offgrid=True)
+
+    def invalidate(self, rect=None):
+        if rect is None:
+            self.chunk_tiles = None
+            self.chunk_surfaces.clear()
+            self.dirty_chunks = set()
+        elif self.chunk_tiles is not None:
+            self.dirty_chunks.update(self.chunks_in(rect))
+
+    def chunks_in(self, rect):
+        size = self.tile_size * CHUNK_SIZE
+        return [(x, y) for y in range(rect.top // size, (rect.bottom - 1) // size + 1)
+                for x in range(rect.left // size, (rect.right - 1) // size + 1)]
+
+    def index_chunks(self):
+        self.chunk_tiles = {}
+        self.chunk_surfaces.clear()
+        self.dirty_chunks = set()
+        self.light.clear()
+        for tile in self.offgrid_tiles:
+            self.add_to_chunks(tile, offgrid=True)
+        for tile in self.tilemap.values():
+            self.add_to_chunks(tile)
+
+    def add_to_chunks(self, tile, offgrid=False, slots=None):
+        if self.chunk_tiles is None:
+            return
+        rect = self.tile_rect(tile, offgrid)
+        if tile['type'] in LIGHT_TILES:
+            self.light.add(id(tile), (rect.centerx, rect.top + LIGHT_OFFSET_Y))
+        for chunk in self.chunks_in(rect):
+            tiles = self.chunk_tiles.setdefault(chunk, ([], []))[0 if offgrid else 1]
+            if slots and chunk in slots:
+                tiles.insert(slots[chunk], tile)
+            else:
+                tiles.append(tile)
+            self.dirty_chunks.add(chunk)
+
+    def remove_from_chunks(self, tile, offgrid=False):
+        slots = {}
+        if self.chunk_tiles is None:
+            return slots
+        if tile['type'] in LIGHT_TILES:
+            self.light.remove(id(tile))
+        for chunk in self.chunks_in(self.tile_rect(tile, offgrid)):
+            tiles = self.chunk_tiles[chunk][0 if offgrid else 1]
+            slots[chunk] = tiles.index(tile)
+            tiles.pop(slots[chunk])
+            self.dirty_chunks.add(chunk)
+        return slots
+
+    def tiles_around(self, pos, out=None):
+        tiles = [] if out is None else out
+        tiles.clear()
+        x = int(pos[0] // self.tile_size) - self.grid_origin[0]
+        y = int(pos[1] // self.tile_size) - self.grid_origin[1]
+        width = self.grid_width
+        height = self.grid_height
         for offset in NEIGHBOR_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] + offset[1])
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            check_x = x + offset[0]
+            check_y = y + offset[1]
+            if 0 <= check_x < width and 0 <= check_y < height:
+                tile = self.grid_tiles[check_y * width + check_x]
+                if tile:
+                    tiles.append(tile)
         return tiles
 
-    def physics_rects_around(self, pos):
-        rects = []
-        for tile in self.tiles_around(pos):
-            if tile['type'] == 'stone':
-                rects.append(
-                    pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size,
-                                self.tile_size))
+    def physics_rects_around(self, pos, axis=0, out=None):
+        rects = [] if out is None else out
+        rects.clear()
+        merged = self.column_rects if axis == 0 else self.row_rects
+        x = int(pos[0] // self.tile_size) - self.grid_origin[0]
+        y = int(pos[1] // self.tile_size) - self.grid_origin[1]
+        width = self.grid_width
+        height = self.grid_height
+        for offset in NEIGHBOR_OFFSETS:
+            check_x = x + offset[0]
+            check_y = y + offset[1]
+            if 0 <= check_x < width and 0 <= check_y < height:
+                rect = merged[check_y * width + check_x]
+                if rect and rect not in rects:
+                    rects.append(rect)
         return rects
 
-    def render(self, surf):
-        for tile in self.offgrid_tiles:
-            surf.blit(self.game.assets[tile['type']], tile['pos'])
+    def draw_chunk(self, chunk, surface=None):
+        size = self.tile_size * CHUNK_SIZE
+        if surface is None:
+            surface = pygame.Surface((size, size))
+            surface.set_colorkey((0, 0, 0))
+        surface.fill((0, 0, 0))
+        origin = (chunk[0] * size, chunk[1] * size)
+        offgrid_tiles, grid_tiles = self.chunk_tiles[chunk]
+        for tile in offgrid_tiles:
+            surface.blit(self.game.assets[tile['type']],
+                         (int(tile['pos'][0]) - origin[0], int(tile['pos'][1]) - origin[1]))
+        for tile in grid_tiles:
+            surface.blit(self.game.assets[tile['type']],
+                         (tile['pos'][0] * self.tile_size - origin[0], tile['pos'][1] * self.tile_size - origin[1]))
+
+        self.chunk_surfaces[chunk] = surface
+        self.chunk_surfaces.move_to_end(chunk)
+        self.dirty_chunks.discard(chunk)
+        return surface
+
+    def render(self, surf, offset=(0, 0)):
+        if self.chunk_tiles is None:
+            self.index_chunks()
+
+        size = self.tile_size * CHUNK_SIZE
+        for chunk in self.chunks_in(pygame.Rect(offset, surf.get_size())):
+            if chunk not in self.chunk_tiles:
+                continue
+            surface = self.chunk_surfaces.get(chunk)
+            if surface is None or chunk in self.dirty_chunks:
+                surface = self.draw_chunk(chunk, surface)
+            else:
+                self.chunk_surfaces.move_to_end(chunk)
+            surf.blit(surface, (chunk[0] * size - offset[0], chunk[1] * size - offset[1]))
 
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            surf.blit(self.game.assets[tile['type']],
-                      (tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size))
+        while len(self.chunk_surfaces) > MAX_CACHED_CHUNKS:
+            self.chunk_surfaces.popitem(last=False)
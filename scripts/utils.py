@@ -5,3 +5,10 @@ def load_image(path):
     img = pygame.image.load('data/images/' + path).convert()
     img.set_colorkey((0, 0, 0))
     return img
+
+
+def tint_image(img, color):
+    img = pygame.transform.grayscale(img)
+    img.fill(color, special_flags=pygame.BLEND_RGB_MULT)
+    img.set_colorkey((0, 0, 0))
+    return img
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import heapq
+import signal
+import argparse
+import multiprocessing
+from array import array
+
+from game import Game, LEVEL_COUNT
+from scripts.inputs import INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP
+from scripts.replay import InputLog
+from scripts.tilemap import PHYSICS_TILES
+
+
+ACTIONS = (INPUT_RIGHT, INPUT_LEFT, INPUT_RIGHT | INPUT_JUMP, INPUT_LEFT | INPUT_JUMP, INPUT_JUMP, 0)
+ACTION_NAMES = {0: '.', INPUT_RIGHT: 'R', INPUT_LEFT: 'L', INPUT_JUMP: 'J', INPUT_RIGHT | INPUT_JUMP: 'r',
+                INPUT_LEFT | INPUT_JUMP: 'l'}
+MACRO_TICKS = 8
+MAX_NODES = 20000
+BATCH_SIZE = 32
+FEATURE_QUANTUM = 4
+ENEMY_QUANTUM = 4
+
+games = {}
+
+
+def get_game(maps_dir, level):
+    game = games.get((maps_dir, level))
+    if game is None:
+        game = Game(headless=True, level=level, maps_dir=maps_dir)
+        games[(maps_dir, level)] = game
+    return game
+
+
+def entity_features(state, i, tile_size):
+    x, y = state[i], state[i + 1]
+    return (int(x + tile_size / 2) // tile_size, int(y + tile_size / 2) // tile_size,
+            int(x) // FEATURE_QUANTUM, int(y) // FEATURE_QUANTUM)
+
+
+def features(game, state):
+    tile_size = game.tilemap.tile_size
+    boxes_end = 6 + len(game.boxes) * 4
+    enemies_end = boxes_end + len(game.enemies) * 5
+    player = entity_features(state, 1, tile_size) + (int(state[5]),)
+    boxes = tuple(entity_features(state, i, tile_size) for i in range(6, boxes_end, 4))
+    switches = tuple(state[enemies_end:])
+    values = [round(value / 2) for value in state[1:5]]
+    values.append(state[5])
+    values.extend(round(value / 2) for value in state[6:boxes_end])
+    for i in range(boxes_end, enemies_end, 5):
+        values.extend((round(state[i] / ENEMY_QUANTUM), round(state[i + 1] / ENEMY_QUANTUM), state[i + 4]))
+    values.extend(switches)
+    return player, boxes, switches, array('i', map(int, values)).tobytes()
+
+
+def novelty(seen, feature):
+    # Every reached state is kept; novelty only orders the frontier. Rank 1 reaches a new position of the player or
+    # of a box, or a new switch state; rank 2 a new tile pairing of them; rank 3 a state that differs once rounded.
+    player, boxes, switches, rounded = feature
+    atoms = [('p', player[2:]), ('s', switches)]
+    atoms.extend(('b', i, box[2:]) for i, box in enumerate(boxes))
+    pairs = [('ps', player[2:], switches)]
+    pairs.extend(('pb', player[:2], i, box[:2]) for i, box in enumerate(boxes))
+    pairs.extend(('bs', i, box[:2], switches) for i, box in enumerate(boxes))
+    rank = 4
+    if rounded not in seen:
+        seen.add(rounded)
+        rank = 3
+    for tier, items in ((2, pairs), (1, atoms)):
+        for item in items:
+            if item not in seen:
+                seen.add(item)
+                rank = tier
+    return rank
+
+
+def run_macro(game, action, macro_ticks):
+    level = game.level
+    deaths = game.deaths
+    for tick in range(macro_ticks):
+        game.step(action if tick == 0 else action & ~INPUT_JUMP)
+        if game.finished or game.level != level:
+            return 'solved', tick + 1
+        if game.deaths != deaths:
+            return 'dead', tick + 1
+    return None, macro_ticks
+
+
+def expand(task):
+    maps_dir, level, state, macro_ticks = task
+    game = get_game(maps_dir, level)
+    parent = array('d')
+    parent.frombytes(state)
+    children = []
+    for action in ACTIONS:
+        game.restore(parent)
+        outcome, ticks = run_macro(game, action, macro_ticks)
+        if outcome == 'dead':
+            continue
+        child = game.snapshot()
+        children.append((action, outcome, ticks, child.tobytes(), features(game, child)))
+        if outcome == 'solved':
+            game.finished = False
+            game.level = level
+            game.load_level(level)
+    return children
+
+
+def exit_position(game):
+    for tile in game.tilemap.tilemap.values():
+        if tile['type'] == 'exit':
+            return tile['pos'][0] * game.tilemap.tile_size, tile['pos'][1] * game.tilemap.tile_size
+    return None
+
+
+def distance_map(game, goal):
+    tiles = game.tilemap.tilemap
+    xs = [tile['pos'][0] for tile in tiles.values()]
+    ys = [tile['pos'][1] for tile in tiles.values()]
+    min_x, max_x, min_y, max_y = min(xs), max(xs), min(ys), max(ys)
+    start = (goal[0] // game.tilemap.tile_size, goal[1] // game.tilemap.tile_size)
+    distances = {start: 0}
+    queue = [start]
+    for loc in queue:
+        for x, y in ((loc[0] + 1, loc[1]), (loc[0] - 1, loc[1]), (loc[0], loc[1] + 1), (loc[0], loc[1] - 1)):
+            if (x, y) in distances or not (min_x <= x <= max_x and min_y <= y <= max_y):
+                continue
+            tile = tiles.get(str(x) + ';' + str(y))
+            if tile and tile['type'] in PHYSICS_TILES:
+                continue
+            distances[(x, y)] = distances[loc] + 1
+            queue.append((x, y))
+    return distances
+
+
+def heuristic(distances, player):
+    return distances.get(player[:2], len(distances))
+
+
+def expand_inputs(actions, macro_ticks, last_ticks):
+    inputs = array('B')
+    for i, action in enumerate(actions):
+        ticks = last_ticks if i == len(actions) - 1 else macro_ticks
+        inputs.append(action)
+        inputs.extend([action & ~INPUT_JUMP] * (ticks - 1))
+    return inputs
+
+
+def verify(maps_dir, level, inputs):
+    game = Game(headless=True, level=level, maps_dir=maps_dir)
+    game.play(inputs)
+    return game if game.finished or game.level != level else None
+
+
+def solve_level(level, maps_dir='data/maps', max_nodes=MAX_NODES, macro_ticks=MACRO_TICKS, pool=None):
+    start = time.perf_counter()
+    game = get_game(maps_dir, level)
+    goal = exit_position(game)
+    distances = distance_map(game, goal) if goal else {}
+    root = game.initial_state
+    root_key = root.tobytes()
+    feature = features(game, root)
+    seen = set()
+    parents = {root_key: None}
+    frontier = [(novelty(seen, feature), heuristic(distances, feature[0]), 0, 0, root_key)]
+    order = 1
+    expanded = 0
+    solution = None
+
+    while frontier and expanded < max_nodes and solution is None:
+        batch = []
+        while frontier and len(batch) < (BATCH_SIZE if pool else 1):
+            batch.append(heapq.heappop(frontier))
+        tasks = [(maps_dir, level, node[4], macro_ticks) for node in batch]
+        results = pool.map(expand, tasks) if pool else [expand(task) for task in tasks]
+        expanded += len(batch)
+        for node, children in zip(batch, results):
+            depth = node[2] + 1
+            for action, outcome, ticks, key, feature in children:
+                if outcome == 'solved':
+                    key = b'solved'
+                elif key in parents:
+                    continue
+                parents[key] = (node[4], action)
+                if outcome == 'solved':
+                    solution = (key, ticks)
+                    break
+                heapq.heappush(frontier, (novelty(seen, feature), heuristic(distances, feature[0]), depth, order, key))
+                order += 1
+            if solution:
+                break
+
+    report = {'level': level, 'solvable': False, 'expanded': expanded, 'states': len(parents)}
+    if solution:
+        actions = []
+        key = solution[0]
+        while parents[key]:
+            key, action = parents[key]
+            actions.append(action)
+        actions.reverse()
+        inputs = expand_inputs(actions, macro_ticks, solution[1])
+        final = verify(maps_dir, level, inputs)
+        report['solvable'] = final is not None
+        report['ticks'] = len(inputs)
+        report['actions'] = ''.join(ACTION_NAMES[action] for action in actions)
+        if final:
+            report['replay'] = InputLog(level, inputs)
+            report['final'] = final
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def solve_task(args):
+    report = solve_level(*args)
+    if 'replay' in report:
+        final = report.pop('final')
+        report['replay'].save(replay_path(args[1], args[0]), final)
+        del report['replay']
+    return report
+
+
+def replay_path(maps_dir, level):
+    return os.path.join(maps_dir, 'solutions', str(level) + '.rpl')
+
+
+def format_report(report):
+    status = 'route' if report['solvable'] else 'NOT SOLVED'
+    line = f"level {report['level']:>2}: {status:<10} {report['expanded']:>6} expanded {report['states']:>7} states " \
+           f"{report['seconds']:6.1f}s"
+    if report['solvable']:
+        line += f" {report['ticks']} ticks {report['actions']}"
+    return line
+
+
+def stop(signum, frame):
+    raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('levels', nargs='*', type=int)
+    parser.add_argument('--maps-dir', default='data/maps')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-nodes', type=int, default=MAX_NODES)
+    parser.add_argument('--macro', type=int, default=MACRO_TICKS)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    levels = args.levels or list(range(LEVEL_COUNT))
+    os.makedirs(os.path.join(args.maps_dir, 'solutions'), exist_ok=True)
+    os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+    signal.signal(signal.SIGTERM, stop)
+    context = multiprocessing.get_context('spawn')
+    reports = []
+    pool = None
+    try:
+        if len(levels) == 1 or args.workers <= 1:
+            pool = context.Pool(args.workers) if args.workers > 1 else None
+            for level in levels:
+                report = solve_level(level, args.maps_dir, args.max_nodes, args.macro, pool)
+                if 'replay' in report:
+                    report.pop('replay').save(replay_path(args.maps_dir, level), report.pop('final'))
+                reports.append(report)
+                print(format_report(report), flush=True)
+        else:
+            pool = context.Pool(min(args.workers, len(levels)))
+            tasks = [(level, args.maps_dir, args.max_nodes, args.macro) for level in levels]
+            for report in pool.imap_unordered(solve_task, tasks):
+                reports.append(report)
+                print(format_report(report), flush=True)
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    reports.sort(key=lambda report: report['level'])
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(reports, f, indent=2)
+        f.close()
+    if not all(report['solvable'] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
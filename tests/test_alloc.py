@@ -0,0 +1,31 @@
+import pytest
+
+from benchmark import allocations
+from game import Game
+from scripts.inputs import INPUT_LEFT, INPUT_RIGHT
+
+LEVELS = (0, 17)
+
+
+@pytest.mark.parametrize('level', LEVELS)
+@pytest.mark.parametrize('inputs', (0, INPUT_RIGHT, INPUT_LEFT))
+def test_step_retains_nothing(level, inputs):
+    game = Game(headless=True, level=level)
+    retained, peak, sources = allocations(game, inputs=inputs)
+    assert sources == {}
+    assert retained == 0
+
+
+def test_retained_allocation_is_reported():
+    game = Game(headless=True, level=LEVELS[0])
+    leaked = []
+    tick = game.signals.tick
+
+    def leaky_tick():
+        leaked.append([0])
+        tick()
+
+    game.signals.tick = leaky_tick
+    retained, peak, sources = allocations(game)
+    assert retained > 0
+    assert any(source.endswith('test_alloc.py:' + str(leaky_tick.__code__.co_firstlineno + 1)) for source in sources)
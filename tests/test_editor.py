@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from editor import line_tiles
+
+
+def test_line_tiles_ends_at_end_in_every_octant():
+    start = (10, 10)
+    for dx in range(-6, 7):
+        for dy in range(-6, 7):
+            end = (start[0] + dx, start[1] + dy)
+            tiles = line_tiles(start, end)
+            assert tiles[0] == start
+            assert tiles[-1] == end
+            assert len(tiles) == max(abs(dx), abs(dy)) + 1
+            for a, b in zip(tiles, tiles[1:]):
+                assert max(abs(b[0] - a[0]), abs(b[1] - a[1])) == 1
+
+
+def test_line_tiles_short_diagonal_drag():
+    assert line_tiles((10, 10), (12, 11)) in ([(10, 10), (11, 10), (12, 11)], [(10, 10), (11, 11), (12, 11)])
@@ -0,0 +1,7 @@
+from solver import solve_level, verify
+
+
+def test_route_replays_to_the_exit():
+    report = solve_level(0)
+    assert report['solvable']
+    assert verify('data/maps', 0, report['replay'].inputs)
@@ -0,0 +1,32 @@
+import random
+import shutil
+
+from game import Game
+from scripts.inputs import INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP
+from scripts.replay import state_hash
+from scripts.streaming import split_map
+
+LEVEL = 12
+TICKS = 600
+
+
+def run(maps_dir, sim_radius=None):
+    game = Game(headless=True, level=LEVEL, maps_dir=maps_dir)
+    if sim_radius is not None:
+        game.stream.sim_radius = sim_radius
+    rng = random.Random(LEVEL)
+    for _ in range(TICKS):
+        game.step(rng.choice((INPUT_RIGHT, INPUT_LEFT, INPUT_RIGHT | INPUT_JUMP, 0)))
+    if game.stream:
+        game.stream.stop()
+    return state_hash(game)
+
+
+def test_streamed_map_is_deterministic(tmp_path):
+    maps_dir = str(tmp_path / 'maps')
+    shutil.copytree('data/maps', maps_dir)
+    split_map(f'{maps_dir}/{LEVEL}.json', f'{maps_dir}/{LEVEL}')
+
+    assert run(maps_dir) == run('data/maps')
+    hashes = {run(maps_dir, sim_radius=0) for _ in range(3)}
+    assert len(hashes) == 1